@@ -1,227 +1,93 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-import json
-import serial
-import serial.tools.list_ports
-import time
 from datetime import datetime
-import plotly.express as px
-import plotly.utils
-import pandas as pd
+import json
 import atexit
+import threading
+import config
+import metrics
+import tracing
+from ledger import InsufficientBalance, PhoneTaken, open_ledger
+from records import Account, Transaction, now, parse_amount, rupees
+from protocol import Error, Failed, Found, Message, NotFound
+from broker_client import SensorBrokerClient, SharedIdempotencyCache
+from sensor import accept_match
+from sensor_pool import SensorPool
+from jobs import IdempotencyCache, JobQueue, Reservations
+from slots import LibraryFull, SlotAllocator
+from series import line_chart
+
+PAYMENTS = metrics.Counter('fingerpay_payments_total', 'Payments by outcome', ['outcome'])
+REGISTRATIONS = metrics.Counter('fingerpay_registrations_total', 'Registrations by outcome', ['outcome'])
+DASHBOARD_SECONDS = metrics.Histogram('fingerpay_dashboard_render_seconds', 'Time to render the admin dashboard')
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
+# Ledger amounts are paise, templates show rupees
+app.add_template_filter(rupees)
 
 # Flask-Login setup (only for admin)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'admin_login'
 
-# Global serial connection
-ser = None
+# Bank storage backend, see config.LEDGER_BACKEND
+ledger = open_ledger()
 
-def find_arduino_port():
-    ports = list(serial.tools.list_ports.comports())
-    
-    if not ports:
-        print("No serial ports found!")
-        return None
+if config.SENSOR_BROKER:
+    # The bridges belong to sensor_broker.py, shared by every worker process
+    # along with the free slots, job status and idempotency keys below
+    sensors = SensorBrokerClient(config.SENSOR_BROKER, used=ledger.fingerprint_ids)
+    sensor_jobs = JobQueue(max_workers=max(len(sensors), 1), shared=sensors)
+    slots = sensors.slots
+    payment_requests = SharedIdempotencyCache(sensors, sensor_jobs)
+else:
+    # Every attached fingerprint bridge, each opened on first use and kept open
+    sensors = SensorPool()
     
-    print("\nAvailable ports:")
-    for port in ports:
-        print(f"Port: {port.device}")
-        print(f"Description: {port.description}")
-        print(f"Hardware ID: {port.hwid}")
-        print("-" * 50)
+    # Sensor operations run here, off the web workers, one per bridge at a time
+    sensor_jobs = JobQueue(max_workers=max(len(sensors), 1))
     
-    # Look for Arduino or CH340
-    for port in ports:
-        if any(id in port.description.lower() for id in ["ch340", "arduino", "usb serial"]):
-            print(f"\nFound likely Arduino port: {port.device}")
-            return port.device
+    # Free fingerprint template slots, rebuilt from the ledger at start-up
+    slots = SlotAllocator(config.SENSOR_CAPACITY, ledger.fingerprint_ids())
     
-    print(f"\nNo Arduino-specific port found, using first available: {ports[0].device}")
-    return ports[0].device
+    # Payment jobs by client idempotency key, so retries never charge twice
+    payment_requests = IdempotencyCache(config.IDEMPOTENCY_KEYS, config.IDEMPOTENCY_TTL)
 
-def initialize_serial():
-    global ser
-    
-    # Find port
-    port = find_arduino_port()
-    if not port:
-        print("No ports available!")
-        return False
-        
-    print(f"Testing port {port}...")
-    
-    try:
-        # Try to clean up any existing connections first
-        if ser is not None:
-            try:
-                ser.close()
-            except:
-                pass
-            ser = None
-            
-        # Wait a moment
-        time.sleep(1)
-        
-        # Open serial connection with all settings explicit
-        ser = serial.Serial(
-            port=port,
-            baudrate=9600,
-            bytesize=serial.EIGHTBITS,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            timeout=1,
-            write_timeout=1,
-            xonxoff=False,    # disable software flow control
-            rtscts=False,     # disable hardware (RTS/CTS) flow control
-            dsrdtr=False      # disable hardware (DSR/DTR) flow control
-        )
-        
-        print("Port opened successfully")
-        
-        if not ser.is_open:
-            print("Opening port...")
-            ser.open()
-            
-        # Reset the device
-        print("Resetting device...")
-        ser.dtr = False
-        time.sleep(0.1)
-        ser.dtr = True
-        time.sleep(2)  # Give the Arduino time to reset
-        
-        # Clear any pending data
-        ser.reset_input_buffer()
-        ser.reset_output_buffer()
-        
-        return True
-        
-    except Exception as e:
-        print(f"Error initializing serial: {e}")
-        if ser is not None:
-            try:
-                ser.close()
-            except:
-                pass
-            ser = None
-        return False
+# Finger scans started by /prepare_payment before Pay is pressed, by phone,
+# each only valid for the amount that was shown while scanning
+armed_captures = Reservations(config.CAPTURE_SECONDS)
 
-def verify_fingerprint():
-    if not initialize_serial():
-        return None, 0
-    
+def verify_fingerprint(expected_id=None, on_acquire=None, on_event=None):
     try:
-        # Send verify command
-        print("Sending verify command...")
-        ser.write(b'V')
-        ser.flush()
-        
-        # Read response with timeout
-        start_time = time.time()
-        while time.time() - start_time < 10:  # 10-second timeout
-            if ser.in_waiting:
-                response = ser.readline().decode('utf-8').strip()
-                print(f"Received: {response}")
-                
-                if "Found ID" in response:
-                    fingerprint_id = int(response.split('#')[1].split()[0])
-                    confidence = int(response.split('of')[1])
-                    return fingerprint_id, confidence
-                elif "Did not find a match" in response:
-                    return None, 0
-                    
-            time.sleep(0.1)
-        
-        print("Verification timed out")
-        return None, 0
-        
+        fingerprint_id, confidence = sensors.verify(expected_id, timeout=10, on_acquire=on_acquire,
+                                                    on_event=on_event)
     except Exception as e:
         print(f"Error during verification: {e}")
         return None, 0
-        
-    finally:
-        if ser is not None:
-            try:
-                ser.close()
-            except:
-                pass
 
-def enroll_fingerprint(finger_id):
-    if not initialize_serial():
-        return False
-    
+    return accept_match(fingerprint_id, confidence)
+
+def enroll_fingerprint(finger_id, on_event=None, on_acquire=None):
     try:
-        # Send enrollment command
-        command = f'E{finger_id}'.encode()
-        print(f"Sending command: {command}")
-        ser.write(command)
-        ser.flush()
-        
-        # Read response with timeout
-        start_time = time.time()
-        while time.time() - start_time < 30:  # 30-second timeout
-            if ser.in_waiting:
-                response = ser.readline().decode('utf-8').strip()
-                print(f"Received: {response}")
-                
-                if "Stored!" in response:
-                    return True
-                elif "Failed" in response:
-                    return False
-                    
-            time.sleep(0.1)
-        
-        print("Enrollment timed out")
-        return False
-        
+        return sensors.enroll(finger_id, timeout=30, on_acquire=on_acquire, on_event=on_event)
     except Exception as e:
         print(f"Error during enrollment: {e}")
         return False
-        
-    finally:
-        if ser is not None:
-            try:
-                ser.close()
-            except:
-                pass
 
 class User(UserMixin):
     def __init__(self, user_data, is_admin=False):
-        self.id = user_data['phone']
-        self.name = user_data['name']
-        self.balance = user_data['balance']
-        self.transactions = user_data['transactions']
+        self.id = user_data.phone
+        self.name = user_data.name
+        self.balance = user_data.balance
+        self.transactions = user_data.transactions
         self.is_admin = is_admin
         if not is_admin:
-            self.fingerprint_id = user_data['fingerprint_id']
-
-def load_data():
-    with open('bank_data.json', 'r') as file:
-        return json.load(file)
-
-def save_data(data):
-    with open('bank_data.json', 'w') as file:
-        json.dump(data, file, indent=4)
-
-def load_users():
-    return load_data()['users']
+            self.fingerprint_id = user_data.fingerprint_id
 
 def load_admin():
-    return load_data()['admin']
-
-def save_users(users):
-    data = load_data()
-    data['users'] = users
-    save_data(data)
-
-def save_admin(admin):
-    data = load_data()
-    data['admin'] = admin
-    save_data(data)
+    # The history is served page by page from /admin/transactions
+    return ledger.admin(transactions=False)
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -229,8 +95,7 @@ def load_user(user_id):
         admin_data = load_admin()
         return User(admin_data, is_admin=True)
     
-    users = load_users()
-    user_data = next((user for user in users if user['phone'] == user_id), None)
+    user_data = ledger.find_user_by_phone(user_id)
     if user_data:
         return User(user_data)
     return None
@@ -248,7 +113,7 @@ def admin_login():
         # Check if admin login
         if phone == "admin":
             admin_data = load_admin()
-            if password and password == admin_data['password']:
+            if password and password == admin_data.password:
                 user = User(admin_data, is_admin=True)
                 login_user(user)
                 return redirect(url_for('admin_dashboard'))
@@ -259,73 +124,297 @@ def admin_login():
             
     return render_template('admin_login.html')
 
+def run_traced(job, trace, func, *args):
+    # Runs a job's func with its trace active, so the sensor and ledger add
+    # their phases, then writes the trace out
+    trace.dequeued()
+    outcome = 'error'
+    with trace.activate():
+        try:
+            result = func(job, *args)
+            outcome = 'success' if result.get('success') else 'failed'
+            return result
+        finally:
+            trace.finish(outcome)
+
+def verify_payer(job, user_data):
+    # Returns whether the user's own finger was matched, and whether the
+    # sensor answered at all (to tell a wrong finger from a timeout)
+    def show_sensor(label):
+        job.progress = f'Place your finger on {label}'
+    
+    answers = []
+    def record_answer(event):
+        if isinstance(event, (Found, NotFound, Failed, Error)):
+            answers.append(event)
+    
+    print("Verifying fingerprint...")
+    fingerprint_id, confidence = verify_fingerprint(user_data.fingerprint_id, on_acquire=show_sensor,
+                                                    on_event=record_answer)
+    return fingerprint_id is not None and fingerprint_id == user_data.fingerprint_id, bool(answers)
+
+def capture_fingerprint(job, phone):
+    # The scan started from /prepare_payment, its result is used by the
+    # payment that claims it
+    user_data = ledger.find_user_by_phone(phone)
+    matched, _ = verify_payer(job, user_data)
+    if not matched:
+        return {
+            'success': False,
+            'message': 'Fingerprint verification failed!'
+        }
+    return {
+        'success': True,
+        'message': 'Fingerprint verified, press Pay to confirm'
+    }
+
+def complete_payment(job, phone, amount, capture=None):
+    user_data = ledger.find_user_by_phone(phone)
+    
+    matched = answered = False
+    if capture is not None:
+        # Usually finished by now, otherwise the finger is on its way
+        job.progress = 'Waiting for the fingerprint scan'
+        with tracing.span('capture_wait'):
+            capture.wait(config.CAPTURE_SECONDS)
+        matched = answered = capture.done and capture.result['success']
+    if not matched:
+        matched, answered = verify_payer(job, user_data)
+    
+    if matched:
+        # Only the debit and credit are locked, never the sensor wait
+        try:
+            with tracing.span('ledger_write'):
+                user_data = ledger.transfer(phone, amount)
+        except InsufficientBalance:
+            PAYMENTS.inc(outcome='insufficient_balance')
+            return {
+                'success': False, 
+                'message': 'Insufficient balance!'
+            }
+        
+        PAYMENTS.inc(outcome='success')
+        return {
+            'success': True, 
+            'message': f'Payment of ₹{rupees(amount):.2f} successful!',
+            'new_balance': rupees(user_data.balance)
+        }
+    else:
+        PAYMENTS.inc(outcome='mismatch' if answered else 'timeout')
+        return {
+            'success': False, 
+            'message': 'Fingerprint verification failed!'
+        }
+
+def payment_response(job):
+    # A finished job's result is returned directly, it may outlive the job
+    # queue's own record of it
+    if job.done:
+        return jsonify(job.result)
+    return jsonify(job.to_dict()), 202
+
 @app.route('/make_payment', methods=['GET', 'POST'])
 def make_payment():
     if request.method == 'POST':
         phone = request.form['phone']
-        amount = float(request.form['amount'])
+        try:
+            # Paise from here on
+            amount = parse_amount(request.form['amount'])
+        except ValueError:
+            amount = 0
+        
+        # A retry with the same key replays the first attempt, before any
+        # validation since the balance may have changed because of it
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+        if key:
+            if len(key) > 100:
+                return jsonify({
+                    'success': False,
+                    'message': 'Invalid idempotency key!'
+                }), 400
+            try:
+                job = payment_requests.get(key, (phone, amount))
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 422
+            if job is not None:
+                print(f"Replaying payment for idempotency key {key}")
+                return payment_response(job)
+        
+        if amount <= 0:
+            PAYMENTS.inc(outcome='invalid')
+            return jsonify({
+                'success': False, 
+                'message': 'Invalid amount!'
+            })
         
-        users = load_users()
-        user_data = next((user for user in users if user['phone'] == phone), None)
+        trace = tracing.Trace('make_payment')
+        with trace.span('lookup'):
+            user_data = ledger.find_user_by_phone(phone)
         
         if not user_data:
+            PAYMENTS.inc(outcome='unknown_phone')
+            trace.finish('unknown_phone')
             return jsonify({
                 'success': False, 
                 'message': 'Phone number not found! Please register first.'
             })
         
-        if user_data['balance'] < amount:
+        # Early check so we don't engage the sensor, transfer() checks again
+        with trace.span('balance_check'):
+            sufficient = user_data.balance >= amount
+        if not sufficient:
+            PAYMENTS.inc(outcome='insufficient_balance')
+            trace.finish('insufficient_balance')
             return jsonify({
                 'success': False, 
                 'message': 'Insufficient balance!'
             })
         
-        print("Verifying fingerprint...")
-        fingerprint_id, confidence = verify_fingerprint()
+        # The sensor wait runs on the job queue, the client polls /jobs/<id>.
+        # A scan started by /prepare_payment for this amount is claimed here,
+        # only once; otherwise the finger is scanned again.
+        capture_id = request.form.get('capture_id')
+        def start(job_id=None):
+            capture = armed_captures.claim(phone, capture_id, amount) if capture_id else None
+            trace.queued()
+            return sensor_jobs.submit('payment', run_traced, trace, complete_payment, phone, amount, capture,
+                                      job_id=job_id)
         
-        if fingerprint_id is not None and fingerprint_id == user_data['fingerprint_id']:
-            # Find user index and update balance
-            user_idx = next((idx for idx, user in enumerate(users) 
-                            if user['phone'] == phone), None)
-            
-            # Deduct from user's account
-            users[user_idx]['balance'] -= amount
-            transaction = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "amount": amount,
-                "type": "payment",
-                "balance": users[user_idx]['balance']
-            }
-            users[user_idx]['transactions'].append(transaction)
-            save_users(users)
-            
-            # Credit admin's account
-            admin_data = load_admin()
-            admin_data['balance'] += amount
-            transaction = {
-                "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "amount": amount,
-                "type": "receive",
-                "from": user_data['name'],
-                "balance": admin_data['balance']
-            }
-            admin_data['transactions'].append(transaction)
-            save_admin(admin_data)
-            
-            return jsonify({
-                'success': True, 
-                'message': f'Payment of ₹{amount:.2f} successful!',
-                'new_balance': users[user_idx]['balance']
-            })
+        if key:
+            try:
+                job = payment_requests.setdefault(key, (phone, amount), start)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e)}), 422
         else:
-            return jsonify({
-                'success': False, 
-                'message': 'Fingerprint verification failed!'
-            })
+            job = start()
+        return payment_response(job)
     
     return render_template('make_payment.html')
 
+@app.route('/prepare_payment', methods=['POST'])
+def prepare_payment():
+    # Called by the payment page once the phone and amount are filled in, so
+    # the sensor is already waiting for the finger when Pay is pressed. The
+    # same checks as /make_payment, which still makes them all again.
+    phone = request.form['phone']
+    try:
+        amount = parse_amount(request.form['amount'])
+    except ValueError:
+        amount = 0
+    
+    if amount <= 0:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid amount!'
+        })
+    
+    user_data = ledger.find_user_by_phone(phone)
+    if not user_data:
+        return jsonify({
+            'success': False,
+            'message': 'Phone number not found! Please register first.'
+        })
+    if user_data.balance < amount:
+        return jsonify({
+            'success': False,
+            'message': 'Insufficient balance!'
+        })
+    
+    # One scan per phone, dropped after CAPTURE_SECONDS if Pay is never
+    # pressed and replaced if the amount changes
+    def start():
+        trace = tracing.Trace('prepare_payment')
+        trace.queued()
+        return sensor_jobs.submit('capture', run_traced, trace, capture_fingerprint, phone)
+    
+    job = armed_captures.reserve(phone, start, amount)
+    return jsonify(job.to_dict()), 202
 
+# Registrations can run in parallel on different bridges, so the phone of each
+# enrollment in progress is reserved here and its fingerprint slot in `slots`
+registration_lock = threading.Lock()
+pending_registrations = {}
+
+def reserve_registration(phone):
+    # Returns the reserved fingerprint ID, None if the phone is taken. Raises
+    # LibraryFull when the sensor has no free template slot.
+    with registration_lock:
+        if phone in pending_registrations or ledger.find_user_by_phone(phone) is not None:
+            return None
+        
+        next_id = slots.reserve()
+        pending_registrations[phone] = next_id
+        return next_id
+
+def complete_registration(job, name, phone, initial_balance):
+    try:
+        with tracing.span('id_allocation'):
+            next_id = reserve_registration(phone)
+    except LibraryFull:
+        REGISTRATIONS.inc(outcome='library_full')
+        return {
+            'success': False,
+            'message': 'The fingerprint sensor is full, no new users can be registered.'
+        }
+    if next_id is None:
+        REGISTRATIONS.inc(outcome='phone_taken')
+        return {
+            'success': False,
+            'message': 'Phone number already registered!'
+        }
+    
+    result = None
+    try:
+        result = enroll_and_register(job, name, phone, initial_balance, next_id)
+        return result
+    finally:
+        # The slot stays taken only if the user was saved
+        if result is not None and result['success']:
+            slots.commit(next_id)
+        else:
+            slots.release(next_id)
+        with registration_lock:
+            del pending_registrations[phone]
+
+def enroll_and_register(job, name, phone, initial_balance, next_id):
+    def show_prompt(event):
+        # Pass the firmware's "Remove finger" style prompts on to the page
+        if isinstance(event, Message) and 'finger' in event.text:
+            job.progress = event.text
+    
+    def show_sensor(label):
+        job.progress = f'Place your finger on {label}'
+    
+    print(f"Enrolling fingerprint with ID: {next_id}")
+    enrollment_result = enroll_fingerprint(next_id, on_event=show_prompt, on_acquire=show_sensor)
+    
+    if enrollment_result:
+        new_user = Account(phone, name, initial_balance,
+                           [Transaction(now(), initial_balance, "deposit", initial_balance)],
+                           fingerprint_id=next_id)
+        
+        try:
+            with tracing.span('ledger_write'):
+                ledger.add_user(new_user)
+        except PhoneTaken:
+            # Registered meanwhile through another web worker
+            REGISTRATIONS.inc(outcome='phone_taken')
+            return {
+                'success': False,
+                'message': 'Phone number already registered!'
+            }
+        
+        REGISTRATIONS.inc(outcome='success')
+        return {
+            'success': True,
+            'message': 'Registration successful! You can now make payments.'
+        }
+    else:
+        REGISTRATIONS.inc(outcome='enroll_failed')
+        return {
+            'success': False,
+            'message': 'Fingerprint enrollment failed! Please try again.'
+        }
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -333,50 +422,45 @@ def register():
         try:
             name = request.form['name']
             phone = request.form['phone']
-            initial_balance = float(request.form['initial_balance'])
+            initial_balance = parse_amount(request.form['initial_balance'])
         except ValueError:
-            flash('Invalid input values. Please check your entries.')
-            return render_template('register.html')
+            return jsonify({
+                'success': False,
+                'message': 'Invalid input values. Please check your entries.'
+            })
 
-        users = load_users()
-        
-        if any(user['phone'] == phone for user in users):
-            flash('Phone number already registered!')
-            return render_template('register.html')
+        if not slots.free:
+            REGISTRATIONS.inc(outcome='library_full')
+            return jsonify({
+                'success': False,
+                'message': 'The fingerprint sensor is full, no new users can be registered.'
+            })
 
-        used_ids = {user['fingerprint_id'] for user in users}
-        next_id = 0
-        while next_id in used_ids:
-            next_id += 1
+        trace = tracing.Trace('register')
+        with trace.span('lookup'):
+            registered = ledger.find_user_by_phone(phone) is not None
+        if registered:
+            REGISTRATIONS.inc(outcome='phone_taken')
+            trace.finish('phone_taken')
+            return jsonify({
+                'success': False,
+                'message': 'Phone number already registered!'
+            })
 
-        print(f"Enrolling fingerprint with ID: {next_id}")
-        enrollment_result = enroll_fingerprint(next_id)
-        
-        if enrollment_result:
-            new_user = {
-                "phone": phone,
-                "name": name,
-                "fingerprint_id": next_id,
-                "balance": initial_balance,
-                "transactions": [{
-                    "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "amount": initial_balance,
-                    "type": "deposit",
-                    "balance": initial_balance
-                }]
-            }
-            
-            users.append(new_user)
-            save_users(users)
-            
-            flash('Registration successful! You can now make payments.')
-            return redirect(url_for('index'))
-        else:
-            flash('Fingerprint enrollment failed! Please try again.')
-            return render_template('register.html')
+        trace.queued()
+        job = sensor_jobs.submit('registration', run_traced, trace, complete_registration,
+                                 name, phone, initial_balance)
+        return jsonify(job.to_dict()), 202
 
     return render_template('register.html')
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = sensor_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown or expired job'}), 404
+    return jsonify(job.to_dict())
+
 @app.route('/admin_dashboard')
 @login_required
 def admin_dashboard():
@@ -384,20 +468,83 @@ def admin_dashboard():
         flash('Access denied!')
         return redirect(url_for('index'))
     
-    admin_data = load_admin()
+    with DASHBOARD_SECONDS.time():
+        admin_data = load_admin()
+        
+        # Balance history graph from the downsampled series, a fixed number of
+        # points however many payments there have been
+        times, balances = ledger.admin_series.points()
+        if times:
+            graph_json = json.dumps(line_chart(times, balances, 'Admin Balance History'))
+        else:
+            graph_json = None
+        
+        return render_template('admin_dashboard.html', 
+                             admin=admin_data,
+                             pending=ledger.pending_settlement(),
+                             graph_json=graph_json)
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus text format, for a scraper on the local network
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def parse_time_filter(value, end_of_day=False):
+    # Accepts "2025-11-06" or "2025-11-06T12:30" style values, returns epoch seconds
+    if not value:
+        return None
+    moment = int(datetime.fromisoformat(value).timestamp())
+    if end_of_day and len(value) == 10:
+        return moment + 24 * 60 * 60 - 1
+    return moment
+
+@app.route('/admin/transactions')
+@login_required
+def admin_transactions():
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Access denied!'}), 403
+    
+    try:
+        start = parse_time_filter(request.args.get('start'))
+        end = parse_time_filter(request.args.get('end'), end_of_day=True)
+        limit = min(max(int(request.args.get('limit', 50)), 1), config.MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid filter values.'}), 400
     
-    # Create balance history graph
-    if admin_data['transactions']:
-        df = pd.DataFrame(admin_data['transactions'])
-        df['date'] = pd.to_datetime(df['date'])
-        fig = px.line(df, x='date', y='balance', title='Admin Balance History')
-        graph_json = plotly.utils.PlotlyJSONEncoder().encode(fig)
-    else:
-        graph_json = None
+    cursor = request.args.get('cursor') or None
+    if cursor is not None and not cursor.isdigit():
+        return jsonify({'success': False, 'message': 'Invalid cursor.'}), 400
     
-    return render_template('admin_dashboard.html', 
-                         admin=admin_data,
-                         graph_json=graph_json)
+    transactions, next_cursor = ledger.admin_transactions(start, end, cursor, limit)
+    return jsonify({
+        'success': True,
+        'transactions': [transaction.to_dict() for transaction in transactions],
+        'next_cursor': next_cursor
+    })
+
+@app.route('/admin/statement/<phone>')
+@login_required
+def user_statement(phone):
+    if not current_user.is_admin:
+        return jsonify({'success': False, 'message': 'Access denied!'}), 403
+    
+    try:
+        start = parse_time_filter(request.args.get('start'))
+        end = parse_time_filter(request.args.get('end'), end_of_day=True)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid filter values.'}), 400
+    
+    # Includes archived history, read only for the months asked for
+    try:
+        transactions = [transaction.to_dict() for transaction in ledger.statement(phone, start, end)]
+    except KeyError:
+        return jsonify({'success': False, 'message': 'Phone number not found!'}), 404
+    
+    return jsonify({
+        'success': True,
+        'phone': phone,
+        'transactions': transactions
+    })
 
 @app.route('/logout')
 @login_required
@@ -407,11 +554,9 @@ def logout():
 
 @atexit.register
 def cleanup():
-    if ser is not None:
-        try:
-            ser.close()
-        except:
-            pass
+    sensor_jobs.shutdown()
+    sensors.close()
+    ledger.close()
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
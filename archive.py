@@ -0,0 +1,124 @@
+import gzip
+import json
+import os
+import threading
+import zlib
+from datetime import datetime
+
+import config
+from records import Transaction
+
+
+def period_of(at):
+    # Segments are per month, named like "2025-11"
+    return datetime.fromtimestamp(at).strftime("%Y-%m")
+
+
+def intact_length(path):
+    # Byte length of the complete gzip members at the start of path, anything
+    # after that is a batch torn by a crash mid-append
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    good = 0
+    while good < len(data):
+        member = zlib.decompressobj(wbits=31)
+        try:
+            member.decompress(data[good:])
+        except zlib.error:
+            break
+        if not member.eof:
+            break
+        good = len(data) - len(member.unused_data)
+    return good
+
+
+class TransactionArchive:
+    # Old per-user transactions moved out of the hot ledger, in one gzip
+    # segment per month (archive/2025-11.jsonl.gz). Segments are append-only:
+    # each batch is written as its own gzip member, which gzip readers see as
+    # one stream. Every line is [phone, n, *transaction row], n being the
+    # transaction's position in the user's full history, so a batch that is
+    # archived twice after a crash is read back once. Segments written before
+    # integer amounts hold one JSON object per line and are read as well.
+
+    def __init__(self, directory=config.ARCHIVE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.checked = set()
+
+    def segment_path(self, period):
+        return os.path.join(self.directory, f'{period}.jsonl.gz')
+
+    def periods(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len('.jsonl.gz')] for name in os.listdir(self.directory)
+                      if name.endswith('.jsonl.gz'))
+
+    def append(self, phone, first, transactions):
+        # transactions are the user's entries first, first + 1, ... of their
+        # history; they are durable on disk when this returns
+        batches = {}
+        for n, transaction in enumerate(transactions, first):
+            batches.setdefault(period_of(transaction.at), []).append([phone, n] + transaction.to_row())
+
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for period, lines in batches.items():
+                path = self.segment_path(period)
+                self.repair(path)
+                payload = ''.join(json.dumps(line, separators=(',', ':')) + '\n' for line in lines)
+                with open(path, 'ab') as file:
+                    file.write(gzip.compress(payload.encode('utf-8')))
+                    file.flush()
+                    os.fsync(file.fileno())
+
+    def repair(self, path):
+        # Once per segment and process, drop a torn batch before appending
+        # after it
+        if path in self.checked:
+            return
+        if os.path.exists(path):
+            good = intact_length(path)
+            if os.path.getsize(path) > good:
+                print(f"Discarding torn archive batch in {path}")
+                with open(path, 'r+b') as file:
+                    file.truncate(good)
+        self.checked.add(path)
+
+    def read(self, phone, count, start=None, end=None):
+        # Yields the first count archived transactions of phone oldest first,
+        # opening only the segments for months between start and end (epoch
+        # seconds). Entries past count were archived but not yet trimmed from
+        # the ledger, which still returns them.
+        first = datetime.fromtimestamp(start).strftime("%Y-%m") if start is not None else None
+        last = datetime.fromtimestamp(end).strftime("%Y-%m") if end is not None else None
+        seen = set()
+        for period in self.periods():
+            if first is not None and period < first:
+                continue
+            if last is not None and period > last:
+                break
+
+            with gzip.open(self.segment_path(period), 'rt', encoding='utf-8') as file:
+                try:
+                    for line in file:
+                        record = json.loads(line)
+                        if isinstance(record, dict):
+                            record_phone, n = record.pop('phone'), record.pop('n')
+                        else:
+                            record_phone, n = record[0], record[1]
+                        if record_phone != phone or n >= count or n in seen:
+                            continue
+                        seen.add(n)
+
+                        if isinstance(record, dict):
+                            transaction = Transaction.from_dict(record)
+                        else:
+                            transaction = Transaction.from_row(record[2:])
+                        if (start is None or transaction.at >= start) and (end is None or transaction.at <= end):
+                            yield transaction
+                except (EOFError, gzip.BadGzipFile, zlib.error):
+                    # A torn last batch, its entries are still in the ledger
+                    pass
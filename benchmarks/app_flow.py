@@ -0,0 +1,148 @@
+import argparse
+import os
+import threading
+import time
+
+from common import emit, latency_summary, make_bank_data, phone_of, work_dir, write_bank_data
+
+# End-to-end throughput of /make_payment and /register through the Flask test
+# client against simulated bridges, and /admin_dashboard render time against
+# admin history length. Linux/macOS only (the simulator needs a pty).
+# Usage: python benchmarks/app_flow.py [--sensors 2] [--output app.json]
+
+
+def wait_for_job(client, job):
+    while True:
+        status = client.get(f"/jobs/{job['job_id']}").get_json()
+        if status['status'] in ('done', 'failed'):
+            return status
+        time.sleep(0.005)
+
+
+def run_clients(app, requests, concurrency):
+    # Each client thread posts its share of requests and waits for each job
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(share):
+        client = app.app.test_client()
+        for path, data in share:
+            started = time.perf_counter()
+            response = client.post(path, data=data)
+            body = response.get_json()
+            if response.status_code == 202:
+                body = wait_for_job(client, body)['result']
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if not body.get('success'):
+                    failures.append(body.get('message'))
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(requests[i::concurrency],))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return dict(latency_summary(latencies), **{
+        'seconds': elapsed,
+        'per_second': len(requests) / elapsed,
+        'failures': len(failures)
+    })
+
+
+def bench_payments(app, simulators, count, concurrency):
+    # Every payment is from user 0, whose finger every simulator presents
+    for simulator in simulators:
+        simulator.finger = 0
+    requests = [('/make_payment', {'phone': phone_of(0), 'amount': '1'})] * count
+    return run_clients(app, requests, concurrency)
+
+
+def bench_registrations(app, count, concurrency):
+    requests = [('/register', {'name': f"New {i}", 'phone': f"8{i:09d}", 'initial_balance': '100'})
+                for i in range(count)]
+    return run_clients(app, requests, concurrency)
+
+
+def bench_dashboard(app, history_lengths, renders):
+    from ledger import JournalLedger
+
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = 'admin'
+        session['_fresh'] = True
+
+    results = []
+    original = app.ledger
+    for length in history_lengths:
+        os.makedirs(f'dashboard-{length}', exist_ok=True)
+        data_file = os.path.join(f'dashboard-{length}', 'bank_data.json')
+        write_bank_data(make_bank_data(10, 1, admin_transactions=length), data_file)
+        app.ledger = JournalLedger(data_file=data_file, journal_file=data_file + '.journal', fsync=False)
+        try:
+            samples = []
+            for _ in range(renders):
+                started = time.perf_counter()
+                response = client.get('/admin_dashboard')
+                samples.append(time.perf_counter() - started)
+                assert response.status_code == 200
+            results.append(dict(latency_summary(samples), history_length=length,
+                                response_bytes=len(response.data)))
+        finally:
+            app.ledger.close()
+            app.ledger = original
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payment, registration and dashboard benchmarks")
+    parser.add_argument('--sensors', type=int, default=2, help="simulated bridges")
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated seconds per sensor operation")
+    parser.add_argument('--payments', type=int, default=200)
+    parser.add_argument('--registrations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--history', default='1000,10000,100000', help="admin history lengths for the dashboard")
+    parser.add_argument('--renders', type=int, default=20, help="dashboard renders per history length")
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    work_dir()
+    write_bank_data(make_bank_data(100, 10))
+
+    from sensor_simulator import SimulatedSensor
+    simulators = [SimulatedSensor(enrolled=range(100), finger=0, match_latency=args.latency,
+                                  enroll_latency=args.latency, capacity=1000, seed=i)
+                  for i in range(args.sensors)]
+    ports = [simulator.start() for simulator in simulators]
+
+    # The app reads its settings at import time
+    os.environ['FINGERPAY_SERIAL_PORT'] = ','.join(ports)
+    os.environ['FINGERPAY_JOURNAL_FSYNC'] = '0'
+    os.environ['FINGERPAY_TRACE_FILE'] = ''
+    import app
+
+    # Connect every bridge up front, so the one-off reset is not in the numbers
+    for sensor in app.sensors.sensors:
+        with sensor.connection.session():
+            pass
+
+    results = {
+        'sensors': args.sensors,
+        'sensor_latency': args.latency,
+        'concurrency': args.concurrency,
+        'payments': bench_payments(app, simulators, args.payments, args.concurrency),
+        'registrations': bench_registrations(app, args.registrations, args.concurrency),
+        'dashboard': bench_dashboard(app, [int(length) for length in args.history.split(',')], args.renders)
+    }
+    for simulator in simulators:
+        simulator.stop()
+    emit('app_flow', results, output)
+
+
+if __name__ == '__main__':
+    main()
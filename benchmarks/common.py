@@ -0,0 +1,118 @@
+import atexit
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+# Shared helpers for the benchmark scripts: synthetic bank data, percentiles
+# and a common JSON result format, so runs from different commits can be
+# diffed with compare.py.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+START_TIME = int(datetime(2024, 1, 1).timestamp())
+
+
+def phone_of(index):
+    return f"9{index:09d}"
+
+
+def make_transactions(count, kind, step, final_balance, counterparty=None):
+    # count transaction rows (see records.py) five minutes apart, each moving
+    # the balance by step paise
+    transactions = []
+    balance = final_balance - step * count
+    for i in range(count):
+        balance += step
+        row = [START_TIME + 300 * i, abs(step), kind, balance]
+        if counterparty is not None:
+            row.append(counterparty)
+        transactions.append(row)
+    return transactions
+
+
+def make_bank_data(users, transactions_per_user=10, admin_transactions=None):
+    # bank_data.json shaped dict in ledger.SNAPSHOT_FORMAT (not imported, the
+    # benchmarks set config through the environment first); user i has phone
+    # phone_of(i) and fingerprint i
+    if admin_transactions is None:
+        admin_transactions = users * transactions_per_user // 2
+    return {
+        "format": 2,
+        "users": [{
+            "phone": phone_of(i),
+            "name": f"User {i}",
+            "fingerprint_id": i,
+            "balance": 100000000,
+            "transactions": make_transactions(transactions_per_user, "payment", -1000, 100000000)
+        } for i in range(users)],
+        "admin": {
+            "phone": "admin",
+            "name": "Admin",
+            "password": "admin123",
+            "balance": admin_transactions * 1000,
+            "transactions": make_transactions(admin_transactions, "receive", 1000, admin_transactions * 1000,
+                                              "Customer")
+        }
+    }
+
+
+def work_dir():
+    # Benchmarks run in a scratch directory, removed at exit, so the repo's
+    # data files are never touched
+    path = tempfile.mkdtemp(prefix='fingerpay-bench-')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    os.chdir(path)
+    return path
+
+
+def write_bank_data(data, path='bank_data.json'):
+    with open(path, 'w') as file:
+        json.dump(data, file)
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an unsorted list
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def latency_summary(seconds):
+    return {
+        'count': len(seconds),
+        'p50_ms': percentile(seconds, 0.5) * 1000,
+        'p95_ms': percentile(seconds, 0.95) * 1000,
+        'p99_ms': percentile(seconds, 0.99) * 1000
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def emit(benchmark, results, output=None):
+    # One document per run, written to output (or stdout) as JSON
+    document = {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'results': results
+    }
+    text = json.dumps(document, indent=4)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
+    return document
@@ -0,0 +1,50 @@
+import argparse
+import json
+
+# Compares two run_all.py result files number by number and flags changes
+# beyond a threshold. Usage: python benchmarks/compare.py old.json new.json
+
+
+def flatten(value, prefix=''):
+    # {'a': [{'b': 1}]} -> {'a.0.b': 1}, numbers only
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        # Lists of per-size results are keyed by their size where there is one
+        items = ((str(item.get('users', item.get('history_length', i))) if isinstance(item, dict) else str(i), item)
+                 for i, item in enumerate(value))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    else:
+        return {}
+
+    flat = {}
+    for key, item in items:
+        flat.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help="relative change to flag (default 0.1)")
+    args = parser.parse_args()
+
+    with open(args.old) as file:
+        old = json.load(file)
+    with open(args.new) as file:
+        new = json.load(file)
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+
+    old_values = flatten(old['benchmarks'])
+    new_values = flatten(new['benchmarks'])
+    for key in sorted(old_values.keys() & new_values.keys()):
+        before, after = old_values[key], new_values[key]
+        change = (after - before) / before if before else 0
+        flag = ' <--' if abs(change) > args.threshold else ''
+        print(f"{key:<60} {before:>14.4f} {after:>14.4f} {change:>+8.1%}{flag}")
+
+
+if __name__ == '__main__':
+    main()
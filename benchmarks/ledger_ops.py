@@ -0,0 +1,82 @@
+import argparse
+import os
+import random
+import time
+
+from common import emit, make_bank_data, phone_of, work_dir, write_bank_data
+
+from ledger import JournalLedger
+
+# Ledger load (snapshot plus journal replay), snapshot save, user lookups and
+# payments at growing user counts, each user with a realistic history.
+# Usage: python benchmarks/ledger_ops.py [--sizes 1000,10000,100000] [--output ledger.json]
+# 1M users needs several GB of memory: --sizes 1000000
+
+
+def timed(func, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def bench_size(users, transactions_per_user, lookups, payments):
+    data = make_bank_data(users, transactions_per_user)
+    write_bank_data(data)
+    del data
+    for path in ('bank_journal.jsonl', 'bank_journal.jsonl.old'):
+        if os.path.exists(path):
+            os.remove(path)
+    data_bytes = os.path.getsize('bank_data.json')
+
+    started = time.perf_counter()
+    ledger = JournalLedger(fsync=False, snapshot_every=10 ** 9, hot_transactions=0, settle_every=0)
+    load_seconds = time.perf_counter() - started
+
+    rng = random.Random(users)
+    phones = [phone_of(rng.randrange(users)) for _ in range(lookups)]
+    fingerprints = [rng.randrange(users) for _ in range(lookups)]
+    lookup_phone = timed(lambda: [ledger.find_user_by_phone(phone) for phone in phones]) / lookups
+    lookup_fingerprint = timed(
+        lambda: [ledger.find_user_by_fingerprint_id(id) for id in fingerprints]) / lookups
+
+    payers = [phone_of(rng.randrange(users)) for _ in range(payments)]
+    payment_seconds = timed(lambda: [ledger.transfer(phone, 100) for phone in payers]) / payments
+
+    started = time.perf_counter()
+    ledger.snapshot(wait=True)
+    save_seconds = time.perf_counter() - started
+    ledger.close()
+
+    return {
+        'users': users,
+        'transactions_per_user': transactions_per_user,
+        'data_bytes': data_bytes,
+        'load_seconds': load_seconds,
+        'save_seconds': save_seconds,
+        'lookup_phone_us': lookup_phone * 1e6,
+        'lookup_fingerprint_us': lookup_fingerprint * 1e6,
+        'payment_us': payment_seconds * 1e6
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ledger load, save, lookup and payment timings")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="comma separated user counts")
+    parser.add_argument('--transactions', type=int, default=20, help="transactions per user")
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--payments', type=int, default=1000, help="journaled payments, without fsync")
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    work_dir()
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        print(f"Benchmarking {size} users...")
+        results.append(bench_size(size, args.transactions, args.lookups, args.payments))
+    emit('ledger_ops', results, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import git_commit
+
+# Runs every benchmark and collects the results into one JSON file per commit,
+# benchmarks/results/<commit>.json by default. Compare two runs with
+# python benchmarks/compare.py old.json new.json
+# Usage: python benchmarks/run_all.py [--quick] [--output results.json]
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+BENCHMARKS = {
+    'startup': ['startup.py'],
+    'ledger_ops': ['ledger_ops.py'],
+    'app_flow': ['app_flow.py'],
+}
+
+# Small sizes for a run of a minute or so
+QUICK_ARGS = {
+    'startup': ['--runs', '3'],
+    'ledger_ops': ['--sizes', '1000,10000', '--payments', '200'],
+    'app_flow': ['--payments', '100', '--registrations', '10', '--history', '1000,10000', '--renders', '5'],
+}
+
+
+def run(name, quick):
+    args = BENCHMARKS[name] + (QUICK_ARGS[name] if quick else [])
+    with tempfile.TemporaryDirectory() as scratch:
+        output = os.path.join(scratch, f'{name}.json')
+        subprocess.run([sys.executable] + args + ['--output', output], cwd=BENCH_DIR, check=True,
+                       stdout=subprocess.DEVNULL)
+        with open(output) as file:
+            return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all benchmarks and save the results")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes")
+    parser.add_argument('--only', help="comma separated benchmark names")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    results = {}
+    for name in names:
+        print(f"Running {name}...")
+        results[name] = run(name, args.quick)
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{git_commit() or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump({'commit': git_commit(), 'quick': args.quick, 'benchmarks': results}, file, indent=4)
+    print(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import REPO_DIR, make_bank_data, work_dir, write_bank_data
+
+# Measures how long `import app` takes in a fresh interpreter, and its peak
+# RSS, so slow imports creeping back into app start-up are easy to spot.
+# The child runs in a scratch directory against a synthetic bank_data.json,
+# so it never opens the repo's ledger files.
+# Usage: python benchmarks/startup.py [--runs 5] [--max-seconds 1.0]
+
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+heavy = sorted(name for name in ('pandas', 'plotly', 'numpy') if name in sys.modules)
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({'seconds': elapsed, 'max_rss_kb': rss_kb, 'heavy_modules': heavy}))
+"""
+
+
+def measure_once():
+    output = subprocess.run([sys.executable, '-c', CHILD, REPO_DIR], check=True,
+                            capture_output=True, text=True).stdout
+    # The app prints while starting, the measurement is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(runs):
+    samples = [measure_once() for _ in range(runs)]
+    seconds = [sample['seconds'] for sample in samples]
+    return {
+        'benchmark': 'startup',
+        'runs': runs,
+        'median_seconds': statistics.median(seconds),
+        'min_seconds': min(seconds),
+        'max_rss_kb': max(sample['max_rss_kb'] for sample in samples),
+        'heavy_modules': samples[-1]['heavy_modules']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app.py import time")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help="exit with an error if the median import time is above this")
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    work_dir()
+    write_bank_data(make_bank_data(100, 10))
+
+    result = measure(args.runs)
+    print(json.dumps(result, indent=4))
+    if output:
+        with open(output, 'w') as file:
+            json.dump(result, file, indent=4)
+
+    if result['heavy_modules']:
+        print(f"Heavy modules imported at start-up: {', '.join(result['heavy_modules'])}")
+    if args.max_seconds is not None and result['median_seconds'] > args.max_seconds:
+        print(f"Start-up took {result['median_seconds']:.3f}s, budget is {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
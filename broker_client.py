@@ -0,0 +1,234 @@
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+import uuid
+
+import config
+import protocol
+import tracing
+from jobs import Job
+from slots import LibraryFull
+
+# Events the broker passes on from the bridges, by name
+EVENTS = {event.__name__: event for event in (
+    protocol.Ready, protocol.Ack, protocol.NoFinger, protocol.ImageTaken, protocol.Found,
+    protocol.NotFound, protocol.Stored, protocol.Failed, protocol.Error, protocol.Message)}
+
+# Exceptions raised in the broker that the caller may want to tell apart
+ERRORS = {error.__name__: error for error in (
+    LookupError, TimeoutError, ValueError, ConnectionError, LibraryFull)}
+
+# On top of the sensor timeout, how long a request may wait for a free bridge
+# (SensorPool.acquire's default) plus some slack
+ACQUIRE_SECONDS = 35
+
+
+class BrokerError(Exception):
+    pass
+
+
+class SensorBrokerClient:
+    # Thin client for sensor_broker.py with the SensorPool interface the app
+    # uses. All threads of a web worker share one socket: every request is
+    # tagged with an ID and a reader thread hands each reply to the thread
+    # waiting for it, so any number of requests can be in flight at once. The
+    # socket is reopened on the next request after the broker goes away.
+
+    def __init__(self, path=config.SENSOR_BROKER, used=None, connect_timeout=5):
+        self.path = path
+        self.used = used   # returns the ledger's fingerprint IDs, sent on connect
+        self.connect_timeout = connect_timeout
+        self.sock = None
+        self.pending = {}  # request ID -> (socket, reply queue)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.slots = BrokerSlots(self)
+
+    def __len__(self):
+        try:
+            return len(self.status()['sensors'])
+        except Exception as e:
+            print(f"Sensor broker unavailable: {e}")
+            return 0
+
+    def connect(self):
+        # Called with self.lock held
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.connect_timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"Sensor broker not running on {self.path}: {e}")
+        sock.settimeout(None)
+        threading.Thread(target=self.read_loop, args=(sock,), name='broker-reader', daemon=True).start()
+
+        # The broker handles hello before any request sent after it
+        used = list(self.used()) if self.used is not None else []
+        self.send(sock, {'id': 0, 'op': 'hello', 'used': used})
+        self.sock = sock
+
+    def send(self, sock, message):
+        data = (json.dumps(message, separators=(',', ':')) + '\n').encode()
+        with self.write_lock:
+            sock.sendall(data)
+
+    def read_loop(self, sock):
+        try:
+            for line in sock.makefile('r', encoding='utf-8'):
+                message = json.loads(line)
+                with self.lock:
+                    entry = self.pending.get(message.get('id'))
+                if entry is not None:
+                    entry[1].put(message)
+        except (OSError, ValueError) as e:
+            print(f"Sensor broker connection error: {e}")
+        finally:
+            with self.lock:
+                if self.sock is sock:
+                    self.sock = None
+                waiting = [replies for owner, replies in self.pending.values() if owner is sock]
+            for replies in waiting:
+                replies.put({'error': "Sensor broker connection lost", 'type': 'ConnectionError'})
+            sock.close()
+
+    def call(self, op, wait=10, on_message=None, **args):
+        # Sends one request and waits up to `wait` seconds for its result.
+        # Progress messages before the result go to on_message.
+        request_id = next(self.ids)
+        replies = queue.Queue()
+        with self.lock:
+            if self.sock is None:
+                self.connect()
+            sock = self.sock
+            self.pending[request_id] = (sock, replies)
+
+        try:
+            sent = time.perf_counter()
+            try:
+                self.send(sock, dict(args, id=request_id, op=op))
+            except OSError as e:
+                with self.lock:
+                    if self.sock is sock:
+                        self.sock = None
+                sock.close()
+                raise ConnectionError(f"Sensor broker connection lost: {e}")
+
+            deadline = time.monotonic() + wait
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Sensor broker did not answer {op} in time")
+                try:
+                    message = replies.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+
+                if 'result' in message:
+                    # The broker's phases, placed relative to when we asked
+                    for span in message.get('spans', ()):
+                        start = sent + span['start']
+                        tracing.add(span['phase'], start, start + span['duration'])
+                    return message['result']
+                if 'error' in message:
+                    raise ERRORS.get(message.get('type'), BrokerError)(message['error'])
+                if on_message is not None:
+                    on_message(message)
+        finally:
+            with self.lock:
+                self.pending.pop(request_id, None)
+
+    def sensor_call(self, op, timeout, on_acquire, on_event, **args):
+        def on_message(message):
+            if 'acquired' in message and on_acquire is not None:
+                on_acquire(message['acquired'])
+            elif 'event' in message and on_event is not None:
+                name, fields = message['event']
+                if name in EVENTS:
+                    on_event(EVENTS[name](*fields))
+
+        return self.call(op, timeout + ACQUIRE_SECONDS, on_message, timeout=timeout, **args)
+
+    def verify(self, expected_id=None, timeout=10, on_acquire=None, on_event=None):
+        fingerprint_id, confidence = self.sensor_call('verify', timeout, on_acquire, on_event,
+                                                      expected_id=expected_id)
+        return fingerprint_id, confidence
+
+    def enroll(self, finger_id, timeout=30, on_acquire=None, on_event=None):
+        return self.sensor_call('enroll', timeout, on_acquire, on_event, finger_id=finger_id)
+
+    def status(self):
+        return self.call('status')
+
+    # Job status for JobQueue(shared=...)
+
+    def put_job(self, data):
+        self.call('job_put', job=data)
+
+    def get_job(self, job_id):
+        return self.call('job_get', job_id=job_id)
+
+    def close(self):
+        with self.lock:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+
+class BrokerSlots:
+    # SlotAllocator interface backed by the broker, so two worker processes
+    # never enroll into the same fingerprint slot. The broker releases the
+    # reservations of a worker whose connection drops.
+
+    def __init__(self, client):
+        self.client = client
+
+    @property
+    def free(self):
+        return self.status()['free']
+
+    def reserve(self):
+        return self.client.call('slot_reserve')
+
+    def commit(self, slot):
+        self.client.call('slot_commit', slot=slot)
+
+    def release(self, slot):
+        self.client.call('slot_release', slot=slot)
+
+    def status(self):
+        return self.client.call('slot_status')
+
+
+class SharedIdempotencyCache:
+    # IdempotencyCache interface backed by the broker, so a retried payment
+    # that reaches a different worker process still gets the original job.
+    # The job ID is claimed for the key before the job is started.
+
+    def __init__(self, client, jobs, kind='payment'):
+        self.client = client
+        self.jobs = jobs
+        self.kind = kind
+
+    def get(self, key, request):
+        job_id = self.client.call('idempotency_get', key=key, request=request)
+        return None if job_id is None else self.job(job_id)
+
+    def setdefault(self, key, request, start):
+        job_id = uuid.uuid4().hex
+        existing = self.client.call('idempotency_setdefault', key=key, request=request, job_id=job_id)
+        if existing == job_id:
+            return start(job_id)
+        return self.job(existing)
+
+    def job(self, job_id):
+        # Another worker may not have published its job yet
+        return self.jobs.get(job_id) or Job(self.kind, job_id)
@@ -0,0 +1,70 @@
+import os
+
+# Settings can be overridden with FINGERPAY_* environment variables
+
+# Ledger storage, either 'json' (snapshot plus journal) or 'sqlite'
+LEDGER_BACKEND = os.environ.get('FINGERPAY_LEDGER', 'json')
+SQLITE_FILE = os.environ.get('FINGERPAY_SQLITE_FILE', 'bank.db')
+DATA_FILE = os.environ.get('FINGERPAY_DATA_FILE', 'bank_data.json')
+JOURNAL_FILE = os.environ.get('FINGERPAY_JOURNAL_FILE', 'bank_journal.jsonl')
+SNAPSHOT_EVERY = int(os.environ.get('FINGERPAY_SNAPSHOT_EVERY', '100'))
+JOURNAL_FSYNC = os.environ.get('FINGERPAY_JOURNAL_FSYNC', '1') == '1'
+
+# Newest transactions kept in each user's record; once a user has twice this
+# many, the older ones move to monthly compressed segments in ARCHIVE_DIR.
+# 0 keeps every transaction in the ledger.
+HOT_TRANSACTIONS = int(os.environ.get('FINGERPAY_HOT_TRANSACTIONS', '100'))
+ARCHIVE_DIR = os.environ.get('FINGERPAY_ARCHIVE_DIR', 'archive')
+
+# Merchant credits: with SETTLE_EVERY at 0 admin is credited on every payment,
+# otherwise credits are batched into one settlement every SETTLE_EVERY
+# payments or SETTLE_SECONDS seconds, whichever comes first
+SETTLE_EVERY = int(os.environ.get('FINGERPAY_SETTLE_EVERY', '0'))
+SETTLE_SECONDS = float(os.environ.get('FINGERPAY_SETTLE_SECONDS', '60'))
+
+# Most points drawn in the admin balance chart, however long the history
+DASHBOARD_POINTS = int(os.environ.get('FINGERPAY_DASHBOARD_POINTS', '500'))
+
+# Largest page the admin transaction API will return
+MAX_PAGE_SIZE = int(os.environ.get('FINGERPAY_MAX_PAGE_SIZE', '100'))
+
+# Payment retries carrying the same idempotency key get the first attempt's
+# result for this many seconds; at most IDEMPOTENCY_KEYS keys are remembered
+IDEMPOTENCY_TTL = int(os.environ.get('FINGERPAY_IDEMPOTENCY_TTL', '600'))
+IDEMPOTENCY_KEYS = int(os.environ.get('FINGERPAY_IDEMPOTENCY_KEYS', '10000'))
+
+# A finger scanned before Pay is pressed stays valid for this many seconds
+CAPTURE_SECONDS = int(os.environ.get('FINGERPAY_CAPTURE_SECONDS', '30'))
+
+# Fingerprint bridge port, found automatically when not set. Set it to the
+# device printed by sensor_simulator.py to run without hardware. Several
+# bridges can be listed separated by commas.
+SERIAL_PORTS = [port.strip() for port in os.environ.get('FINGERPAY_SERIAL_PORT', '').split(',') if port.strip()]
+SERIAL_PORT = SERIAL_PORTS[0] if SERIAL_PORTS else None
+
+# Unix socket of sensor_broker.py. When set, the app asks the broker for every
+# sensor operation instead of opening the bridges itself, so it can run as
+# several worker processes.
+SENSOR_BROKER = os.environ.get('FINGERPAY_SENSOR_BROKER', '')
+
+# Template slots on each fingerprint sensor, fingerprint IDs run from 0 to
+# SENSOR_CAPACITY - 1
+SENSOR_CAPACITY = int(os.environ.get('FINGERPAY_SENSOR_CAPACITY', '127'))
+
+# How many bridges each user's fingerprint is enrolled on, and where the
+# assignment of users to bridges is kept
+SENSOR_REPLICAS = int(os.environ.get('FINGERPAY_SENSOR_REPLICAS', '1'))
+SENSOR_ASSIGNMENTS_FILE = os.environ.get('FINGERPAY_SENSOR_ASSIGNMENTS_FILE', 'sensor_assignments.json')
+
+# Fingerprint bridge link, negotiated after the bridge boots at 9600 baud
+SENSOR_BAUDRATE = int(os.environ.get('FINGERPAY_SENSOR_BAUDRATE', '115200'))
+SENSOR_COMPACT = os.environ.get('FINGERPAY_SENSOR_COMPACT', '1') == '1'
+
+# Lowest sensor confidence score accepted as a match, 0 accepts any match
+MATCH_CONFIDENCE = int(os.environ.get('FINGERPAY_MATCH_CONFIDENCE', '0'))
+
+# Per-request phase traces, one JSON line per request in a rotating log.
+# An empty FINGERPAY_TRACE_FILE turns tracing off.
+TRACE_FILE = os.environ.get('FINGERPAY_TRACE_FILE', 'traces.jsonl')
+TRACE_MAX_BYTES = int(os.environ.get('FINGERPAY_TRACE_MAX_BYTES', str(5 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get('FINGERPAY_TRACE_BACKUPS', '3'))
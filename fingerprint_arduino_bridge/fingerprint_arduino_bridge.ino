@@ -9,9 +9,26 @@
 SoftwareSerial fingerSerial(FINGERPRINT_RX, FINGERPRINT_TX);
 Adafruit_Fingerprint finger = Adafruit_Fingerprint(&fingerSerial);
 
+// How long M waits for a finger, inside the host's 10 second verify timeout
+#define CAPTURE_MS 9000
+
+// Compact mode replaces the text responses with one-letter codes, see protocol.py
+bool compactMode = false;
+
+// Prints a response in verbose or compact form depending on the current mode.
+// Pass NULL as compact to print nothing in compact mode.
+void respond(const char* verbose, const char* compact) {
+  if (!compactMode) {
+    Serial.println(verbose);
+  } else if (compact != NULL) {
+    Serial.println(compact);
+  }
+}
+
 void setup() {
   // Start serial communication with computer
   Serial.begin(9600);
+  Serial.setTimeout(100);  // For parseInt() on command arguments
   while (!Serial);
 
   // Start fingerprint sensor
@@ -27,69 +44,72 @@ void setup() {
   Serial.println("Ready to receive commands:");
   Serial.println("E - Enroll new fingerprint");
   Serial.println("V - Verify/match fingerprint");
+  Serial.println("M - Match against one stored ID, e.g. M5");
+  Serial.println("B - Set baud rate, e.g. B115200");
+  Serial.println("C - Compact responses on (C1) or off (C0)");
 }
 
 uint8_t getFingerprintEnroll(uint8_t id) {
   int p = -1;
-  Serial.println("Waiting for valid finger to enroll");
+  respond("Waiting for valid finger to enroll", "P W");
   while (p != FINGERPRINT_OK) {
     p = finger.getImage();
     switch (p) {
     case FINGERPRINT_OK:
-      Serial.println("Image taken");
+      respond("Image taken", "I");
       break;
     case FINGERPRINT_NOFINGER:
-      Serial.println(".");
+      respond(".", NULL);
       break;
     case FINGERPRINT_PACKETRECIEVEERR:
-      Serial.println("Communication error");
+      respond("Communication error", "W COMM");
       break;
     case FINGERPRINT_IMAGEFAIL:
-      Serial.println("Imaging error");
+      respond("Imaging error", "W IMAGING");
       break;
     default:
-      Serial.println("Unknown error");
+      respond("Unknown error", "W UNKNOWN");
       break;
     }
   }
 
   p = finger.image2Tz(1);
   if (p != FINGERPRINT_OK) {
-    Serial.println("Image conversion failed");
+    respond("Image conversion failed", "X IMAGE");
     return p;
   }
 
-  Serial.println("Remove finger");
+  respond("Remove finger", "P R");
   delay(2000);
   p = 0;
   while (p != FINGERPRINT_NOFINGER) {
     p = finger.getImage();
   }
 
-  Serial.println("Place same finger again");
+  respond("Place same finger again", "P A");
   while (p != FINGERPRINT_OK) {
     p = finger.getImage();
   }
 
   p = finger.image2Tz(2);
   if (p != FINGERPRINT_OK) {
-    Serial.println("Image conversion failed");
+    respond("Image conversion failed", "X IMAGE");
     return p;
   }
 
   p = finger.createModel();
   if (p != FINGERPRINT_OK) {
-    Serial.println("Failed to create model");
+    respond("Failed to create model", "X MODEL");
     return p;
   }
 
   p = finger.storeModel(id);
   if (p != FINGERPRINT_OK) {
-    Serial.println("Failed to store model");
+    respond("Failed to store model", "X STORE");
     return p;
   }
 
-  Serial.println("Stored!");
+  respond("Stored!", "S");
   return true;
 }
 
@@ -102,36 +122,137 @@ uint8_t getFingerprintMatching() {
 
   p = finger.fingerFastSearch();
   if (p == FINGERPRINT_OK) {
-    Serial.print("Found ID #"); Serial.print(finger.fingerID);
-    Serial.print(" with confidence of "); Serial.println(finger.confidence);
+    if (compactMode) {
+      Serial.print("F "); Serial.print(finger.fingerID);
+      Serial.print(" "); Serial.println(finger.confidence);
+    } else {
+      Serial.print("Found ID #"); Serial.print(finger.fingerID);
+      Serial.print(" with confidence of "); Serial.println(finger.confidence);
+    }
   } else if (p == FINGERPRINT_NOTFOUND) {
-    Serial.println("Did not find a match");
+    respond("Did not find a match", "N");
+  } else {
+    respond("Unknown error", "W UNKNOWN");
+  }
+  return p;
+}
+
+// Compares the templates in char buffers 1 and 2 on the sensor (instruction
+// 0x03, not wrapped by the Adafruit library). Sets score on a match.
+uint8_t matchBuffers(uint16_t &score) {
+  uint8_t data[] = {0x03};
+  Adafruit_Fingerprint_Packet packet(FINGERPRINT_COMMANDPACKET, sizeof(data), data);
+  finger.writeStructuredPacket(packet);
+  if (finger.getStructuredPacket(&packet) != FINGERPRINT_OK || packet.type != FINGERPRINT_ACKPACKET) {
+    return FINGERPRINT_PACKETRECIEVEERR;
+  }
+  score = ((uint16_t)packet.data[1] << 8) | packet.data[2];
+  return packet.data[0];
+}
+
+// 1:1 verification: matches the finger against the one template stored at id
+// instead of searching the whole library, so it takes the same time however
+// many users are enrolled. Responds like getFingerprintMatching().
+uint8_t getFingerprintMatchingId(uint16_t id) {
+  // loadModel() always loads into char buffer 1, so the live scan below is
+  // converted into buffer 2
+  uint8_t p = finger.loadModel(id);
+  if (p != FINGERPRINT_OK) {
+    respond("Failed to load template", "X LOAD");
+    return p;
+  }
+
+  // Capture mode: the host may send M before the finger is on the sensor
+  respond("Place your finger on the sensor", "P F");
+  unsigned long started = millis();
+  while ((p = finger.getImage()) == FINGERPRINT_NOFINGER) {
+    if (millis() - started > CAPTURE_MS) {
+      respond("Capture failed, no finger placed", "X NOFINGER");
+      return p;
+    }
+  }
+  if (p != FINGERPRINT_OK) {
+    respond("Imaging error", "W IMAGING");
+    return p;
+  }
+
+  p = finger.image2Tz(2);
+  if (p != FINGERPRINT_OK) {
+    respond("Image conversion failed", "X IMAGE");
+    return p;
+  }
+
+  uint16_t score = 0;
+  p = matchBuffers(score);
+  if (p == FINGERPRINT_OK) {
+    if (compactMode) {
+      Serial.print("F "); Serial.print(id);
+      Serial.print(" "); Serial.println(score);
+    } else {
+      Serial.print("Found ID #"); Serial.print(id);
+      Serial.print(" with confidence of "); Serial.println(score);
+    }
+  } else if (p == FINGERPRINT_NOMATCH) {
+    respond("Did not find a match", "N");
   } else {
-    Serial.println("Unknown error");
+    respond("Unknown error", "W UNKNOWN");
   }
   return p;
 }
 
+bool isSupportedBaud(long baud) {
+  return baud == 9600 || baud == 19200 || baud == 38400 || baud == 57600 || baud == 115200;
+}
+
 void loop() {
   if (Serial.available()) {
     char cmd = Serial.read();
     if (cmd == 'V') {
-      Serial.println("Starting verification...");
+      respond("Starting verification...", "K V");
       getFingerprintMatching();
     }
+    else if (cmd == 'M') {
+      int id = Serial.parseInt();
+      if (compactMode) {
+        Serial.print("K M ");
+      } else {
+        Serial.print("Starting verification of ID #");
+      }
+      Serial.println(id);
+      getFingerprintMatchingId(id);
+    }
     else if (cmd == 'E') {
       // Read the ID number that follows the 'E'
-      String idStr = "";
-      while (Serial.available()) {
-        char c = Serial.read();
-        if (isdigit(c)) {
-          idStr += c;
-        }
+      int id = Serial.parseInt();
+      if (compactMode) {
+        Serial.print("K E ");
+      } else {
+        Serial.print("Starting enrollment for ID #");
       }
-      int id = idStr.toInt();
-      Serial.print("Starting enrollment for ID #");
       Serial.println(id);
       getFingerprintEnroll(id);
     }
+    else if (cmd == 'B') {
+      long baud = Serial.parseInt();
+      if (isSupportedBaud(baud)) {
+        // Acknowledge at the old rate, then switch
+        if (compactMode) {
+          Serial.print("K B ");
+        } else {
+          Serial.print("Switching to ");
+        }
+        Serial.print(baud);
+        if (!compactMode) Serial.print(" baud");
+        Serial.println();
+        Serial.flush();
+        Serial.end();
+        Serial.begin(baud);
+      }
+    }
+    else if (cmd == 'C') {
+      compactMode = Serial.parseInt() != 0;
+      Serial.print("K C ");
+      Serial.println(compactMode ? 1 : 0);
+    }
   }
-}
\ No newline at end of file
+}
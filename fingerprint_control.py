@@ -1,32 +1,23 @@
 import serial
-import time
+import config
+from sensor import SensorConnection
 
 class FingerprintSensor:
-    def __init__(self, port='COM7', baudrate=9600):
-        self.serial = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for Arduino to reset
-        
-    def read_response(self):
-        while True:
-            if self.serial.in_waiting:
-                response = self.serial.readline().decode('utf-8').strip()
-                print(response)
-                if "Stored!" in response or "Failed" in response or "Found ID" in response or "Did not find a match" in response:
-                    return response
-            time.sleep(0.1)
+    def __init__(self, port=config.SERIAL_PORT or 'COM7', baudrate=9600):
+        self.sensor = SensorConnection(port, baudrate)
+        self.sensor.connect()  # Waits for the Arduino to reset
 
     def enroll_fingerprint(self):
         print("Starting fingerprint enrollment...")
-        self.serial.write(b'E')  # Send enrollment command to Arduino
-        return self.read_response()
+        return self.sensor.enroll(0)
 
     def verify_fingerprint(self):
         print("Starting fingerprint verification...")
-        self.serial.write(b'V')  # Send verification command to Arduino
-        return self.read_response()
+        fingerprint_id, confidence = self.sensor.verify()
+        return fingerprint_id
 
     def close(self):
-        self.serial.close()
+        self.sensor.close()
 
 def main():
     try:
@@ -41,15 +32,13 @@ def main():
             choice = input("Enter your choice (1-3): ")
             
             if choice == '1':
-                result = sensor.enroll_fingerprint()
-                if "Stored!" in result:
+                if sensor.enroll_fingerprint():
                     print("Fingerprint enrolled successfully!")
                 else:
                     print("Enrollment failed!")
                     
             elif choice == '2':
-                result = sensor.verify_fingerprint()
-                if "Found ID" in result:
+                if sensor.verify_fingerprint() is not None:
                     print("Fingerprint matched!")
                 else:
                     print("No match found!")
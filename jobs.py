@@ -0,0 +1,219 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, kind, job_id=None, on_change=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.result = None
+        self.finished_at = None
+        self.finished = threading.Event()
+        self.on_change = on_change
+        self.progress = 'Waiting for the sensor'
+
+    @classmethod
+    def from_dict(cls, data):
+        # A job run by another process, as last published to the broker
+        job = cls(data['kind'], data['job_id'])
+        job.status = data['status']
+        job.progress = data['progress']
+        job.result = data['result']
+        return job
+
+    @property
+    def progress(self):
+        return self._progress
+
+    @progress.setter
+    def progress(self, text):
+        self._progress = text
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result
+        }
+
+
+class JobQueue:
+    # Runs sensor operations on a dedicated executor so web workers return
+    # immediately with a job ID. Finished jobs are kept for keep_seconds so
+    # clients can poll for the result.
+    #
+    # With several web worker processes a poll may reach a process other than
+    # the one running the job, so every change is also published to `shared`
+    # (the sensor broker) and looked up there for unknown IDs.
+
+    def __init__(self, max_workers=1, keep_seconds=300, shared=None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sensor-job')
+        self.keep_seconds = keep_seconds
+        self.shared = shared
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, func, *args, job_id=None):
+        # func is called as func(job, *args) and returns the job's result dict
+        job = Job(kind, job_id, on_change=self.publish if self.shared is not None else None)
+        with self.lock:
+            self.prune()
+            self.jobs[job.id] = job
+        self.executor.submit(self.run, job, func, args)
+        return job
+
+    def run(self, job, func, args):
+        job.status = 'running'
+        try:
+            job.result = func(job, *args)
+            job.status = 'done'
+        except Exception as e:
+            print(f"Error in {job.kind} job: {e}")
+            job.result = {'success': False, 'message': 'Sensor error. Please try again.'}
+            job.status = 'failed'
+        job.finished_at = time.time()
+        job.progress = None
+        job.finished.set()
+
+    def publish(self, job):
+        try:
+            self.shared.put_job(job.to_dict())
+        except Exception as e:
+            print(f"Error publishing job {job.id}: {e}")
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None and self.shared is not None:
+            try:
+                data = self.shared.get_job(job_id)
+            except Exception as e:
+                print(f"Error looking up job {job_id}: {e}")
+                data = None
+            if data is not None:
+                job = Job.from_dict(data)
+        return job
+
+    def prune(self):
+        cutoff = time.time() - self.keep_seconds
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class IdempotencyCache:
+    # Remembers the job started for each client idempotency key, so a retried
+    # request gets the original job back instead of running the sensor and
+    # the debit again. At most max_entries keys are kept, each for ttl seconds;
+    # the oldest are dropped first when full.
+
+    def __init__(self, max_entries=10000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()   # key -> (expires, request, job)
+        self.lock = threading.Lock()
+
+    def get(self, key, request):
+        # The job recorded for key, or None. Raises ValueError when the key
+        # was first used for a different request.
+        with self.lock:
+            self.prune()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] != request:
+                raise ValueError("Idempotency key was already used for a different request")
+            return entry[2]
+
+    def setdefault(self, key, request, start):
+        # Calls start() to create the job only if no concurrent request with
+        # the same key got there first
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] != request:
+                    raise ValueError("Idempotency key was already used for a different request")
+                return entry[2]
+
+            job = start()
+            self.entries[key] = (time.monotonic() + self.ttl, request, job)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return job
+
+    def prune(self):
+        # Entries are in insertion order, which is also expiry order
+        now = time.monotonic()
+        while self.entries:
+            key, (expires, _, _) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            del self.entries[key]
+
+
+class Reservations:
+    # Jobs started ahead of the request that will use them, such as a finger
+    # scan begun while the payment form is still being filled in. Each request
+    # has at most one, claimed once by its job ID and dropped if nobody claims
+    # it within ttl seconds. terms are what the job was started for, such as
+    # the amount shown during the scan; a claim must bring the same terms.
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.entries = OrderedDict()   # request -> (expires, job, terms)
+        self.lock = threading.Lock()
+
+    def reserve(self, request, start, terms=None):
+        # The job already reserved for request on the same terms, unless it
+        # has finished without success, else a new one from start()
+        with self.lock:
+            self.prune()
+            entry = self.entries.get(request)
+            if entry is not None and entry[2] == terms:
+                job = entry[1]
+                if not job.done or job.result.get('success'):
+                    return job
+
+            job = start()
+            self.entries.pop(request, None)
+            self.entries[request] = (time.monotonic() + self.ttl, job, terms)
+            return job
+
+    def claim(self, request, job_id, terms=None):
+        # The reserved job if it has this ID and terms, None if it expired,
+        # was claimed or was started for something else
+        with self.lock:
+            self.prune()
+            entry = self.entries.get(request)
+            if entry is None or entry[1].id != job_id or entry[2] != terms:
+                return None
+            del self.entries[request]
+            return entry[1]
+
+    def prune(self):
+        # Entries are in insertion order, which is also expiry order
+        now = time.monotonic()
+        while self.entries:
+            request, (expires, _, _) = next(iter(self.entries.items()))
+            if expires > now:
+                break
+            del self.entries[request]
@@ -0,0 +1,663 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+import config
+import metrics
+import tracing
+from archive import TransactionArchive
+from ledger_sync import FileLock, SharedCounters
+from records import Account, Transaction, now, parse_amount, parse_date
+from series import BalanceSeries
+
+LOAD_SECONDS = metrics.Histogram(
+    'fingerpay_ledger_load_seconds', 'Time to load the snapshot and replay the journal')
+LOAD_BYTES = metrics.Gauge(
+    'fingerpay_ledger_load_bytes', 'Snapshot and journal bytes read at start-up')
+APPEND_SECONDS = metrics.Histogram(
+    'fingerpay_journal_append_seconds', 'Time to write and sync one journal record')
+APPEND_BYTES = metrics.Counter(
+    'fingerpay_journal_bytes_total', 'Bytes appended to the journal')
+SNAPSHOT_SECONDS = metrics.Histogram(
+    'fingerpay_snapshot_write_seconds', 'Time to write a bank_data.json snapshot')
+SNAPSHOT_BYTES = metrics.Gauge(
+    'fingerpay_snapshot_bytes', 'Size of the last snapshot written')
+
+# bank_data.json written with integer amounts and transaction rows, see
+# records.py. Files without it are the original rupees and date strings.
+SNAPSHOT_FORMAT = 2
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+class PhoneTaken(Exception):
+    pass
+
+
+def read_journal(path):
+    # Returns the decoded records and the byte length of the intact prefix
+    records = []
+    good_bytes = 0
+    if not os.path.exists(path):
+        return records, good_bytes
+
+    with open(path, 'rb') as file:
+        for line in file:
+            # A missing newline or bad JSON means a crash mid-append
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            good_bytes += len(line)
+    return records, good_bytes
+
+
+class AccountStore:
+    # The bank state as Account records plus the pending settlement, with hash
+    # indexes by phone and fingerprint_id. All writes must go through the
+    # store so the indexes stay in step.
+
+    def __init__(self, users, admin, pending=None):
+        self.users = users
+        self.admin = admin
+        self.pending = pending
+        self.by_phone = {}
+        self.by_fingerprint = {}
+        for user in users:
+            self.index(user)
+
+    @classmethod
+    def from_snapshot(cls, data):
+        if data.get('format') == SNAPSHOT_FORMAT:
+            return cls([Account.from_record(user) for user in data['users']],
+                       Account.from_record(data['admin']), data.get('pending_settlement'))
+
+        # Written before integer amounts, converted once here
+        pending = data.get('pending_settlement')
+        if pending is not None:
+            pending = {
+                "amount": parse_amount(pending['amount']),
+                "payments": pending['payments'],
+                "payers": {phone: [parse_amount(payer['amount']), payer['payments']]
+                           for phone, payer in pending['payers'].items()}
+            }
+        return cls([Account.from_dict(user) for user in data['users']],
+                   Account.from_dict(data['admin']), pending)
+
+    def to_snapshot(self):
+        data = {
+            "format": SNAPSHOT_FORMAT,
+            "users": [user.to_record() for user in self.users],
+            "admin": self.admin.to_record()
+        }
+        if self.pending is not None:
+            data['pending_settlement'] = self.pending
+        return data
+
+    def index(self, user):
+        self.by_phone[user.phone] = user
+        self.by_fingerprint[user.fingerprint_id] = user
+
+    def find_user_by_phone(self, phone):
+        return self.by_phone.get(phone)
+
+    def find_user_by_fingerprint_id(self, fingerprint_id):
+        return self.by_fingerprint.get(fingerprint_id)
+
+    def add_user(self, user):
+        self.users.append(user)
+        self.index(user)
+        return user
+
+
+def new_settlement():
+    # Merchant credits not yet settled, in paise, with [paise, payments] per
+    # payer phone
+    return {"amount": 0, "payments": 0, "payers": {}}
+
+
+def journal_amount(record):
+    # Records journaled before integer amounts carry rupees and a date string
+    return record['amount'] if 'at' in record else parse_amount(record['amount'])
+
+
+def journal_time(record):
+    return record['at'] if 'at' in record else parse_date(record['date'])
+
+
+def apply_record(accounts, record):
+    # Applies one journal record to the bank state, used both live and on replay
+    op = record['op']
+    if op == 'payment':
+        user = accounts.by_phone[record['phone']]
+        amount = journal_amount(record)
+        at = journal_time(record)
+
+        user.balance -= amount
+        user.transactions.append(Transaction(at, amount, "payment", user.balance))
+
+        if record.get('batched'):
+            # The merchant is credited later by a 'settle' record
+            if accounts.pending is None:
+                accounts.pending = new_settlement()
+            pending = accounts.pending
+            pending['amount'] += amount
+            pending['payments'] += 1
+            payer = pending['payers'].setdefault(user.phone, [0, 0])
+            payer[0] += amount
+            payer[1] += 1
+            return user
+
+        admin = accounts.admin
+        admin.balance += amount
+        admin.transactions.append(Transaction(at, amount, "receive", admin.balance, user.name))
+        return user
+
+    if op == 'register':
+        if 'account' in record:
+            return accounts.add_user(Account.from_record(record['account']))
+        return accounts.add_user(Account.from_dict(record['user']))
+
+    if op == 'archive':
+        # The oldest count entries were written to the archive beforehand
+        user = accounts.by_phone[record['phone']]
+        del user.transactions[:record['count']]
+        user.archived += record['count']
+        return user
+
+    if op == 'settle':
+        pending, accounts.pending = accounts.pending, None
+        admin = accounts.admin
+        admin.balance += pending['amount']
+        settlement = Transaction(journal_time(record), pending['amount'], "settlement", admin.balance,
+                                 None, pending['payments'], pending['payers'])
+        admin.transactions.append(settlement)
+        return settlement
+
+    raise ValueError(f"Unknown journal record: {op}")
+
+
+class Ledger:
+    # Storage interface used by the web app and payment_system.py. Backends
+    # are picked by name in open_ledger(); users and admin are returned as
+    # records.Account, their history as records.Transaction, amounts in paise
+    # and times in epoch seconds. Backends also keep admin_series, the admin
+    # balance history, current as of the last admin() call. Both backends can
+    # be opened by several processes at once and see each other's writes.
+    #
+    # With settle_every > 0, payments debit the payer straight away but the
+    # admin credit is held as a pending settlement. Every settle_every payments
+    # or settle_seconds seconds it is credited as one "settlement" transaction
+    # carrying the payment count and the breakdown per payer phone.
+    #
+    # Users keep their newest hot_transactions entries; older ones are moved
+    # to the TransactionArchive and read back lazily by statement().
+
+    admin_series = None
+    archive = None
+    hot_transactions = 0
+    settle_every = 0
+    settle_seconds = 60
+    settle_timer = None
+
+    def init_settlement(self, settle_every, settle_seconds):
+        self.settle_every = settle_every
+        self.settle_seconds = settle_seconds
+        self.settle_guard = threading.Lock()
+        if self.pending_settlement() is not None:
+            self.schedule_settlement(0)
+
+    def schedule_settlement(self, pending_payments):
+        # Called after each batched payment: settles once enough payments are
+        # pending, otherwise makes sure a timer settles them soon
+        if pending_payments >= self.settle_every > 0:
+            self.settle()
+            return
+        with self.settle_guard:
+            if self.settle_timer is None or not self.settle_timer.is_alive():
+                self.settle_timer = threading.Timer(self.settle_seconds, self.settle_on_timer)
+                self.settle_timer.daemon = True
+                self.settle_timer.start()
+
+    def settle_on_timer(self):
+        try:
+            self.settle()
+        except Exception as e:
+            print(f"Error settling merchant credits: {e}")
+
+    def cancel_settlement_timer(self):
+        with self.settle_guard:
+            if self.settle_timer is not None:
+                self.settle_timer.cancel()
+                self.settle_timer = None
+
+    def admin(self, transactions=True):
+        # transactions=False lets a backend skip loading the history
+        raise NotImplementedError
+
+    def admin_transactions(self, start=None, end=None, cursor=None, limit=50):
+        # One page of admin transactions, newest first, optionally limited to
+        # epoch seconds start <= t <= end. Returns (transactions, next_cursor);
+        # pass next_cursor back for the next page, it is None on the last one.
+        raise NotImplementedError
+
+    def find_user_by_phone(self, phone):
+        raise NotImplementedError
+
+    def find_user_by_fingerprint_id(self, fingerprint_id):
+        raise NotImplementedError
+
+    def fingerprint_ids(self):
+        # Every fingerprint ID in use
+        raise NotImplementedError
+
+    def transfer(self, phone, amount):
+        # Checks the balance, debits the user and credits admin (or the pending
+        # settlement) as one atomic step, returns the updated user record.
+        # amount is in paise.
+        # Raises KeyError for an unknown phone and InsufficientBalance if the
+        # balance does not cover amount.
+        raise NotImplementedError
+
+    def add_user(self, user):
+        # Raises PhoneTaken if an account with user.phone already exists,
+        # possibly added by another process
+        raise NotImplementedError
+
+    def statement(self, phone, start=None, end=None):
+        # A user's whole history oldest first, optionally limited to epoch
+        # seconds start <= t <= end. Archived entries are read lazily, only
+        # from the months in range.
+        user = self.find_user_by_phone(phone)
+        if user is None:
+            raise KeyError(phone)
+
+        def transactions():
+            if self.archive is not None and user.archived:
+                yield from self.archive.read(phone, user.archived, start, end)
+            for transaction in user.transactions:
+                if (start is None or transaction.at >= start) and (end is None or transaction.at <= end):
+                    yield transaction
+        return transactions()
+
+    def pending_settlement(self):
+        # The unsettled merchant credits in the shape of new_settlement(), or
+        # None when nothing is pending
+        raise NotImplementedError
+
+    def settle(self):
+        # Credits the pending payments to admin now, returns the settlement
+        # transaction or None if nothing was pending
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JournalLedger(Ledger):
+    # Bank state lives in memory. Every change is appended to a journal as one
+    # compact line, and the journal is periodically folded into a snapshot of
+    # bank_data.json by a background thread. On startup the state is rebuilt
+    # from the snapshot plus the journal tail.
+    #
+    # Several processes can share the files, e.g. the web app and
+    # payment_system.py (see ledger_sync.py). Writes are made
+    # under a FileLock after replaying whatever other processes appended, and
+    # the newest journal seq is published in a shared counter; reads compare
+    # it with their own seq and only replay the journal tail when it differs.
+
+    def __init__(self, data_file=config.DATA_FILE, journal_file=config.JOURNAL_FILE,
+                 snapshot_every=config.SNAPSHOT_EVERY, fsync=config.JOURNAL_FSYNC,
+                 settle_every=config.SETTLE_EVERY, settle_seconds=config.SETTLE_SECONDS,
+                 hot_transactions=config.HOT_TRANSACTIONS, archive_dir=config.ARCHIVE_DIR):
+        self.data_file = data_file
+        self.journal_file = journal_file
+        self.old_journal_file = journal_file + '.old'
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.lock = FileLock(journal_file + '.lock')
+        # seq: the newest record in the journal, snapshot_seq: the newest
+        # record folded into bank_data.json
+        self.shared = SharedCounters(journal_file + '.gen', ('seq', 'snapshot_seq'))
+        self.snapshot_thread = None
+        self.hot_transactions = hot_transactions
+        self.archive = TransactionArchive(archive_dir)
+
+        with self.lock:
+            self.accounts = self.recover()
+            self.admin_series = BalanceSeries.from_transactions(self.accounts.admin.transactions)
+            self.open_journal()
+            self.catch_up()
+            self.shared['seq'] = self.seq
+        self.init_settlement(settle_every, settle_seconds)
+
+    def recover(self, fold=True):
+        # Called with the lock held
+        started = time.perf_counter()
+        with open(self.data_file, 'r') as file:
+            data = json.load(file)
+        loaded_bytes = os.path.getsize(self.data_file)
+
+        self.seq = data.pop('journal_seq', 0)
+        self.shared['snapshot_seq'] = self.seq
+        accounts = AccountStore.from_snapshot(data)
+        del data
+        self.since_snapshot = 0
+
+        # A rotated journal is left behind if the last snapshot never finished,
+        # or is still being written by another process
+        for path in (self.old_journal_file, self.journal_file):
+            records, good_bytes = read_journal(path)
+            loaded_bytes += good_bytes
+            for record in records:
+                if record['seq'] > self.seq:
+                    apply_record(accounts, record)
+                    self.seq = record['seq']
+                    self.since_snapshot += 1
+
+            if os.path.exists(path) and os.path.getsize(path) > good_bytes:
+                print(f"Discarding torn journal tail in {path}")
+                with open(path, 'r+b') as file:
+                    file.truncate(good_bytes)
+
+        if fold and os.path.exists(self.old_journal_file):
+            # Fold everything into a fresh snapshot before rotating again. A
+            # process still writing its own snapshot sees snapshot_seq move
+            # past it and drops it.
+            self.write_snapshot(self.dump(accounts), self.seq)
+            for path in (self.old_journal_file, self.journal_file):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # Windows: still open in another process. Its records
+                    # are all in the snapshot and are skipped by seq.
+                    print(f"Could not remove {path}: {e}")
+            self.since_snapshot = 0
+
+        LOAD_SECONDS.observe(time.perf_counter() - started)
+        LOAD_BYTES.set(loaded_bytes)
+        return accounts
+
+    def open_journal(self):
+        # Called with the lock held. Binary append mode: writes always land at
+        # the end, reads start from journal_offset.
+        self.journal = open(self.journal_file, 'a+b')
+        self.journal_offset = 0
+
+    def catch_up(self):
+        # Called with the lock held. Applies the records other processes
+        # appended since this one last looked, following the journal through
+        # snapshot rotations. An open file keeps its inode, so a journal that
+        # was renamed or removed never matches the path again.
+        while True:
+            self.journal.seek(self.journal_offset)
+            for line in self.journal:
+                # A missing newline or bad JSON means a writer died mid-append
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if record['seq'] > self.seq + 1:
+                    self.reload()
+                    return
+                self.journal_offset += len(line)
+                if record['seq'] > self.seq:
+                    self.apply(record)
+            if os.fstat(self.journal.fileno()).st_size > self.journal_offset:
+                print(f"Discarding torn journal tail in {self.journal_file}")
+                self.journal.truncate(self.journal_offset)
+
+            try:
+                current = os.stat(self.journal_file).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(self.journal.fileno()).st_ino:
+                break
+            self.journal.close()
+            self.open_journal()
+
+        if self.seq < self.shared['seq']:
+            self.reload()
+
+    def reload(self):
+        # Called with the lock held, when whole journals were folded into a
+        # snapshot and removed while this process was not looking
+        self.journal.close()
+        self.accounts = self.recover(fold=False)
+        self.shared['seq'] = self.seq
+        self.admin_series = BalanceSeries.from_transactions(self.accounts.admin.transactions)
+        self.open_journal()
+        self.catch_up()
+
+    def refresh(self):
+        # Before a read: a memory access when no other process has written
+        if self.shared['seq'] != self.seq:
+            with self.lock:
+                self.catch_up()
+
+    def apply(self, record):
+        # Applies one record, written by this process or another
+        result = apply_record(self.accounts, record)
+        self.seq = record['seq']
+        self.since_snapshot += 1
+        if record['op'] == 'settle' or (record['op'] == 'payment' and not record.get('batched')):
+            admin = self.accounts.admin
+            self.admin_series.append(admin.transactions[-1].at, admin.balance)
+        return result
+
+    def dump(self, accounts):
+        return json.dumps(dict(accounts.to_snapshot(), journal_seq=self.seq), separators=(',', ':'))
+
+    def admin(self, transactions=True):
+        self.refresh()
+        return self.accounts.admin
+
+    def admin_transactions(self, start=None, end=None, cursor=None, limit=50):
+        # admin_series.times runs parallel to the admin transactions and is
+        # sorted, so it doubles as the timestamp index
+        self.refresh()
+        times = self.admin_series.times
+        low = bisect_left(times, start) if start is not None else 0
+        high = bisect_right(times, end) if end is not None else len(times)
+        if cursor is not None:
+            high = min(high, int(cursor))
+
+        page_start = max(low, high - limit)
+        page = self.accounts.admin.transactions[page_start:high]
+        next_cursor = str(page_start) if page_start > low else None
+        return page[::-1], next_cursor
+
+    def find_user_by_phone(self, phone):
+        self.refresh()
+        return self.accounts.find_user_by_phone(phone)
+
+    def find_user_by_fingerprint_id(self, fingerprint_id):
+        self.refresh()
+        return self.accounts.find_user_by_fingerprint_id(fingerprint_id)
+
+    def fingerprint_ids(self):
+        self.refresh()
+        return list(self.accounts.by_fingerprint)
+
+    def append(self, record):
+        # Called with the lock held, after catch_up()
+        record = dict(seq=self.seq + 1, **record)
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        started = time.perf_counter()
+        self.journal.write(line)
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        APPEND_SECONDS.observe(time.perf_counter() - started)
+        APPEND_BYTES.inc(len(line))
+        self.journal_offset += len(line)
+
+        result = self.apply(record)
+        self.shared['seq'] = self.seq
+
+        if self.since_snapshot >= self.snapshot_every:
+            self.snapshot()
+        return result
+
+    def transfer(self, phone, amount):
+        if amount <= 0:
+            raise ValueError(f"Invalid amount: {amount}")
+
+        # The balance check and the debit are made under the lock, after
+        # replaying other processes' payments
+        with self.lock:
+            self.catch_up()
+            user = self.accounts.find_user_by_phone(phone)
+            if user is None:
+                raise KeyError(phone)
+            if user.balance < amount:
+                raise InsufficientBalance(phone)
+            record = {
+                "op": "payment",
+                "phone": phone,
+                "amount": amount,
+                "at": now()
+            }
+            if self.settle_every:
+                # Only the payer is updated, admin waits for the settlement
+                record['batched'] = True
+                user = self.append(record)
+                pending_payments = self.accounts.pending['payments']
+            else:
+                # The admin credit is applied with the payment record itself
+                with tracing.span('admin_credit'):
+                    user = self.append(record)
+            archive = self.hot_transactions and len(user.transactions) >= 2 * self.hot_transactions
+
+        if self.settle_every:
+            with tracing.span('admin_credit'):
+                self.schedule_settlement(pending_payments)
+        if archive:
+            with tracing.span('archive'):
+                self.archive_user(phone)
+        return user
+
+    def archive_user(self, phone):
+        # The entries are on disk in the archive before the trim is journaled;
+        # a crash in between leaves them in both, and the archive reads them
+        # back once. Checked again under the lock, another thread or process
+        # may have got there first.
+        with self.lock:
+            self.catch_up()
+            user = self.accounts.find_user_by_phone(phone)
+            if len(user.transactions) < 2 * self.hot_transactions:
+                return
+            old = user.transactions[:-self.hot_transactions]
+            self.archive.append(user.phone, user.archived, old)
+            self.append({"op": "archive", "phone": user.phone, "count": len(old)})
+
+    def add_user(self, user):
+        with self.lock:
+            self.catch_up()
+            if self.accounts.find_user_by_phone(user.phone) is not None:
+                raise PhoneTaken(user.phone)
+            return self.append({"op": "register", "account": user.to_record()})
+
+    def pending_settlement(self):
+        self.refresh()
+        return self.accounts.pending
+
+    def settle(self):
+        with self.lock:
+            self.cancel_settlement_timer()
+            self.catch_up()
+            if self.accounts.pending is None:
+                return None
+            return self.append({"op": "settle", "at": now()})
+
+    def snapshot(self, wait=False):
+        with self.lock:
+            # A rotated journal means a snapshot is still being written, by
+            # this process or another
+            self.catch_up()
+            busy = os.path.exists(self.old_journal_file)
+            if not busy and self.seq > self.shared['snapshot_seq']:
+                # Serialize and rotate the journal under the lock, write to disk outside it
+                payload = self.dump(self.accounts)
+                self.journal.close()
+                self.since_snapshot = 0
+                offset = self.journal_offset
+                try:
+                    os.replace(self.journal_file, self.old_journal_file)
+                except OSError as e:
+                    # Windows cannot rename a file another process has open.
+                    # The records are safe in the journal, so keep appending
+                    # to it and try again after another snapshot_every.
+                    print(f"Snapshot deferred, journal in use: {e}")
+                    self.open_journal()
+                    self.journal_offset = offset
+                else:
+                    self.open_journal()
+                    self.snapshot_thread = threading.Thread(
+                        target=self.finish_snapshot, args=(payload, self.seq), daemon=True)
+                    self.snapshot_thread.start()
+            thread = self.snapshot_thread
+
+        if wait and thread is not None:
+            thread.join()
+
+    def finish_snapshot(self, payload, seq):
+        try:
+            self.write_snapshot(payload, seq, rotated=True)
+        except Exception as e:
+            print(f"Error writing snapshot: {e}")
+
+    def write_snapshot(self, payload, seq, rotated=False):
+        # Installed together with removing the rotated journal it replaces,
+        # unless a process that started meanwhile has already folded
+        # everything into a newer snapshot (and removed that journal)
+        started = time.perf_counter()
+        # A name of its own: the startup fold and a background snapshot may
+        # write the same seq at once
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.data_file) + '.', suffix='.tmp',
+                                        dir=os.path.dirname(os.path.abspath(self.data_file)))
+        os.chmod(tmp_file, 0o644)  # mkstemp() makes it private
+        with os.fdopen(fd, 'w') as file:
+            file.write(payload)
+            file.flush()
+            os.fsync(file.fileno())
+        with self.lock:
+            if seq <= self.shared['snapshot_seq']:
+                os.remove(tmp_file)
+                return
+            os.replace(tmp_file, self.data_file)
+            self.shared['snapshot_seq'] = seq
+            if rotated:
+                os.remove(self.old_journal_file)
+        SNAPSHOT_SECONDS.observe(time.perf_counter() - started)
+        SNAPSHOT_BYTES.set(len(payload))
+
+    def close(self):
+        if self.journal.closed:
+            return
+        self.settle()
+        self.snapshot(wait=True)
+        with self.lock:
+            self.journal.close()
+        self.shared.close()
+        self.lock.close()
+
+
+def open_ledger(backend=config.LEDGER_BACKEND):
+    if backend == 'json':
+        return JournalLedger()
+    if backend == 'sqlite':
+        from sqlite_ledger import SqliteLedger
+        return SqliteLedger()
+    raise ValueError(f"Unknown ledger backend: {backend}")
@@ -0,0 +1,98 @@
+import errno
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Lets several processes (the web app and payment_system.py, or several web
+# workers) share one JSON ledger. Writers take a FileLock; every process keeps
+# its own in-memory copy and compares it against a shared counter to see
+# whether another process has written since it last looked.
+
+
+def lock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+        return
+    # Windows: a lock on the first byte. LK_LOCK gives up after about ten
+    # seconds, keep waiting like flock() does.
+    file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError as e:
+            if e.errno != errno.EDEADLOCK:
+                raise
+
+
+def unlock_file(file):
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+        return
+    file.seek(0)
+    msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    # Reentrant lock held across threads and processes: an RLock for this
+    # process plus an exclusive lock on path (flock(), or msvcrt.locking() on
+    # Windows) while the outermost holder is inside.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a+b')
+        self.lock = threading.RLock()
+        self.depth = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        if self.depth == 0:
+            try:
+                lock_file(self.file)
+            except BaseException:
+                self.lock.release()
+                raise
+        self.depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if self.depth == 0:
+            unlock_file(self.file)
+        self.lock.release()
+
+    def close(self):
+        self.file.close()
+
+
+class SharedCounters:
+    # A few 64-bit counters in a small memory-mapped file, so reading one
+    # costs a memory access and no system call. Only written with the
+    # FileLock held.
+
+    def __init__(self, path, names):
+        self.offsets = {name: 8 * i for i, name in enumerate(names)}
+        size = 8 * len(names)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def __getitem__(self, name):
+        return struct.unpack_from('<Q', self.map, self.offsets[name])[0]
+
+    def __setitem__(self, name, value):
+        struct.pack_into('<Q', self.map, self.offsets[name], value)
+
+    def close(self):
+        self.map.close()
@@ -0,0 +1,29 @@
+import sys
+
+import config
+from ledger import JournalLedger
+from sqlite_ledger import SqliteLedger
+
+# Imports bank_data.json (plus any journal records not yet in the snapshot)
+# into a new SQLite ledger. Usage: python migrate_to_sqlite.py [bank.db]
+
+
+def migrate(sqlite_file=config.SQLITE_FILE):
+    source = JournalLedger()
+    target = SqliteLedger(sqlite_file)
+    try:
+        # Pending merchant credits are settled first, the import copies balances
+        source.settle()
+        target.import_data(source.accounts)
+        print(f"Imported {len(source.accounts.users)} users and the admin account into {sqlite_file}")
+    finally:
+        target.close()
+        source.close()
+
+
+if __name__ == '__main__':
+    try:
+        migrate(*sys.argv[1:2])
+    except ValueError as e:
+        print(f"Migration failed: {e}")
+        sys.exit(1)
@@ -1,52 +1,27 @@
 import serial
-import json
-import time
-from datetime import datetime
+import config
+from ledger import InsufficientBalance, open_ledger
+from records import format_date, parse_amount, rupees
+from sensor import SensorConnection, accept_match
 
 class PaymentSystem:
-    def __init__(self, port='COM7', baudrate=9600):
-        self.serial = serial.Serial(port, baudrate, timeout=1)
-        time.sleep(2)  # Wait for Arduino to reset
-        self.load_database()
-
-    def load_database(self):
-        with open('bank_data.json', 'r') as file:
-            self.database = json.load(file)
-
-    def save_database(self):
-        with open('bank_data.json', 'w') as file:
-            json.dump(self.database, file, indent=4)
-
-    def read_arduino_response(self):
-        while True:
-            if self.serial.in_waiting:
-                response = self.serial.readline().decode('utf-8').strip()
-                print(response)
-                if "Found ID" in response or "Did not find a match" in response:
-                    return response
-            time.sleep(0.1)
-
-    def verify_fingerprint(self):
+    def __init__(self, port=config.SERIAL_PORT or 'COM7', baudrate=9600):
+        self.sensor = SensorConnection(port, baudrate)
+        self.sensor.connect()  # Waits for the Arduino to reset
+        # The same ledger as the web app, which may be running at the same
+        # time; lookups see its payments and ours are journaled alongside
+        self.ledger = open_ledger()
+
+    def verify_fingerprint(self, expected_id=None):
         print("\nPlace your finger on the sensor...")
-        self.serial.write(b'V')  # Send verification command to Arduino
-        response = self.read_arduino_response()
-        if "Found ID" in response:
-            fingerprint_id = int(response.split('#')[1].split()[0])
-            confidence = int(response.split('of')[1])
-            return fingerprint_id, confidence
-        return None, 0
+        fingerprint_id, confidence = self.sensor.verify(timeout=10, expected_id=expected_id)
+        return accept_match(fingerprint_id, confidence)
 
     def find_user_by_phone(self, phone):
-        for user in self.database['users']:
-            if user['phone'] == phone:
-                return user
-        return None
+        return self.ledger.find_user_by_phone(phone)
 
     def find_user_by_fingerprint_id(self, fingerprint_id):
-        for user in self.database['users']:
-            if user['fingerprint_id'] == fingerprint_id:
-                return user
-        return None
+        return self.ledger.find_user_by_fingerprint_id(fingerprint_id)
 
     def process_payment(self, phone_number, amount):
         # Find user by phone number
@@ -55,46 +30,36 @@ class PaymentSystem:
             print(f"\nNo user found with phone number: {phone_number}")
             return False
 
-        print(f"\nWelcome {user['name']}!")
-        print(f"Amount to be paid: ₹{amount:.2f}")
+        print(f"\nWelcome {user.name}!")
+        print(f"Amount to be paid: ₹{rupees(amount):.2f}")
         
         # Verify fingerprint
         print("\nPlease verify your fingerprint...")
-        fingerprint_id, confidence = self.verify_fingerprint()
+        fingerprint_id, confidence = self.verify_fingerprint(user.fingerprint_id)
         
         if fingerprint_id is None:
             print("\nFingerprint verification failed!")
             return False
 
         # Verify if fingerprint matches the user
-        if fingerprint_id != user['fingerprint_id']:
+        if fingerprint_id != user.fingerprint_id:
             print("\nFingerprint does not match the registered user!")
             return False
 
-        # Check if user has sufficient balance
-        if user['balance'] < amount:
+        # Checks the balance and records the payment in one step
+        try:
+            user = self.ledger.transfer(phone_number, amount)
+        except InsufficientBalance:
             print("\nInsufficient balance!")
             return False
-
-        # Process payment
-        user['balance'] -= amount
-        transaction = {
-            "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "amount": amount,
-            "type": "payment",
-            "balance": user['balance']
-        }
-        user['transactions'].append(transaction)
-        
-        # Save updated database
-        self.save_database()
         
         print("\nPayment Successful!")
-        print(f"Remaining balance: ₹{user['balance']:.2f}")
+        print(f"Remaining balance: ₹{rupees(user.balance):.2f}")
         return True
 
     def close(self):
-        self.serial.close()
+        self.sensor.close()
+        self.ledger.close()
 
 def main():
     try:
@@ -111,7 +76,7 @@ def main():
             if choice == '1':
                 phone = input("\nEnter your phone number: ")
                 try:
-                    amount = float(input("Enter payment amount: ₹"))
+                    amount = parse_amount(input("Enter payment amount: ₹"))
                     if amount <= 0:
                         print("Invalid amount!")
                         continue
@@ -125,22 +90,22 @@ def main():
                 phone = input("\nEnter your phone number: ")
                 user = payment_system.find_user_by_phone(phone)
                 if user:
-                    print(f"\nWelcome {user['name']}!")
-                    print(f"Current balance: ₹{user['balance']:.2f}")
+                    print(f"\nWelcome {user.name}!")
+                    print(f"Current balance: ₹{rupees(user.balance):.2f}")
                     
                     # Verify fingerprint for security
                     print("\nPlease verify your fingerprint...")
-                    fingerprint_id, confidence = payment_system.verify_fingerprint()
+                    fingerprint_id, confidence = payment_system.verify_fingerprint(user.fingerprint_id)
                     
-                    if fingerprint_id is None or fingerprint_id != user['fingerprint_id']:
+                    if fingerprint_id is None or fingerprint_id != user.fingerprint_id:
                         print("\nFingerprint verification failed!")
                     else:
                         print("\nRecent Transactions:")
-                        for transaction in user['transactions'][-5:]:  # Show last 5 transactions
-                            print(f"Date: {transaction['date']}")
-                            print(f"Amount: ₹{transaction['amount']:.2f}")
-                            print(f"Type: {transaction['type']}")
-                            print(f"Balance: ₹{transaction['balance']:.2f}")
+                        for transaction in user.transactions[-5:]:  # Show last 5 transactions
+                            print(f"Date: {format_date(transaction.at)}")
+                            print(f"Amount: ₹{rupees(transaction.amount):.2f}")
+                            print(f"Type: {transaction.type}")
+                            print(f"Balance: ₹{rupees(transaction.balance):.2f}")
                             print("-" * 30)
                 else:
                     print(f"\nNo user found with phone number: {phone}")
@@ -0,0 +1,128 @@
+import re
+from collections import namedtuple
+
+# Line protocol spoken by fingerprint_arduino_bridge.ino. The bridge starts in
+# verbose mode at DEFAULT_BAUDRATE; the host can then switch it to a faster
+# baud rate (B) and between verbose and compact one-letter responses (C).
+# parse_line() accepts both forms, so the host does not need to track which
+# mode is active.
+
+DEFAULT_BAUDRATE = 9600
+SUPPORTED_BAUDRATES = (9600, 19200, 38400, 57600, 115200)
+
+VERIFY_COMMAND = b'V'
+
+
+def enroll_command(finger_id):
+    return f'E{finger_id}\n'.encode()
+
+
+def match_command(finger_id):
+    # 1:1 verification against one stored template
+    return f'M{finger_id}\n'.encode()
+
+
+def baud_command(baudrate):
+    return f'B{baudrate}\n'.encode()
+
+
+def mode_command(compact):
+    return f'C{int(compact)}\n'.encode()
+
+
+# Events parsed from the bridge's output lines
+Ready = namedtuple('Ready', [])
+Ack = namedtuple('Ack', ['command', 'value'])   # command accepted
+NoFinger = namedtuple('NoFinger', [])
+ImageTaken = namedtuple('ImageTaken', [])
+Found = namedtuple('Found', ['fingerprint_id', 'confidence'])
+NotFound = namedtuple('NotFound', [])
+Stored = namedtuple('Stored', [])
+Failed = namedtuple('Failed', ['reason'])          # operation aborted
+Error = namedtuple('Error', ['reason'])            # sensor error, enrollment retries
+Message = namedtuple('Message', ['text'])          # prompts and other chatter
+Disconnected = namedtuple('Disconnected', ['reason'])
+
+# Compact responses are one letter, optionally followed by arguments
+COMPACT_PATTERN = re.compile(r'^([KIFNSXWP])(?: (.*))?$')
+COMPACT_PROMPTS = {
+    'W': "Waiting for valid finger to enroll",
+    'R': "Remove finger",
+    'A': "Place same finger again",
+    'F': "Place your finger on the sensor",
+}
+COMPACT_FAILURES = {
+    'IMAGE': "Image conversion failed",
+    'MODEL': "Failed to create model",
+    'STORE': "Failed to store model",
+    'LOAD': "Failed to load template",
+    'NOFINGER': "Capture failed, no finger placed",
+}
+COMPACT_ERRORS = {
+    'COMM': "Communication error",
+    'IMAGING': "Imaging error",
+    'UNKNOWN': "Unknown error",
+}
+
+FOUND_PATTERN = re.compile(r'Found ID #(\d+) with confidence of (\d+)')
+ENROLL_PATTERN = re.compile(r'Starting enrollment for ID #(\d+)')
+MATCH_PATTERN = re.compile(r'Starting verification of ID #(\d+)')
+BAUD_PATTERN = re.compile(r'Switching to (\d+) baud')
+
+
+def parse_compact(code, args):
+    if code == 'K':
+        command, _, value = args.partition(' ')
+        return Ack(command, value or None)
+    if code == 'I':
+        return ImageTaken()
+    if code == 'F':
+        fingerprint_id, confidence = args.split()
+        return Found(int(fingerprint_id), int(confidence))
+    if code == 'N':
+        return NotFound()
+    if code == 'S':
+        return Stored()
+    if code == 'X':
+        return Failed(COMPACT_FAILURES.get(args, args))
+    if code == 'W':
+        return Error(COMPACT_ERRORS.get(args, args))
+    return Message(COMPACT_PROMPTS.get(args, args))
+
+
+def parse_line(line):
+    match = COMPACT_PATTERN.match(line)
+    if match:
+        return parse_compact(match.group(1), match.group(2) or '')
+
+    if line == '.':
+        return NoFinger()
+    if line.startswith('Ready to receive commands'):
+        return Ready()
+    if line == 'Image taken':
+        return ImageTaken()
+    if line == 'Stored!':
+        return Stored()
+    if line == 'Did not find a match':
+        return NotFound()
+    if line == 'Starting verification...':
+        return Ack('V', None)
+
+    match = FOUND_PATTERN.match(line)
+    if match:
+        return Found(int(match.group(1)), int(match.group(2)))
+    match = ENROLL_PATTERN.match(line)
+    if match:
+        return Ack('E', match.group(1))
+    match = MATCH_PATTERN.match(line)
+    if match:
+        return Ack('M', match.group(1))
+    match = BAUD_PATTERN.match(line)
+    if match:
+        return Ack('B', match.group(1))
+
+    if 'failed' in line.lower() or line.startswith('Did not find fingerprint sensor'):
+        return Failed(line)
+    if line.endswith('error'):
+        return Error(line)
+    return Message(line)
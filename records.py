@@ -0,0 +1,151 @@
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+# Ledger records. Inside the ledgers every amount and balance is an integer
+# number of paise and every time is integer epoch seconds, so sums are exact
+# and time ranges need no date parsing. Rupees and "%Y-%m-%d %H:%M:%S" strings
+# only appear at the edges: web responses and templates (to_dict(), rupees())
+# and bank data written before this format, which is converted on load
+# (from_dict()).
+#
+# Transactions are stored as rows, [at, amount, type, balance] plus the
+# counterparty and settlement details when present, in snapshots, journal
+# records and the archive.
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_amount(value):
+    # "12.5", 12.5 or 12 rupees -> 1250 paise, without going through float
+    # arithmetic. Raises ValueError.
+    try:
+        amount = Decimal(str(value).strip())
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value}")
+    if not amount.is_finite():
+        raise ValueError(f"Invalid amount: {value}")
+    return int((amount * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def rupees(paise):
+    return paise / 100
+
+
+def now():
+    return int(time.time())
+
+
+def parse_date(date):
+    return int(datetime.strptime(date, DATE_FORMAT).timestamp())
+
+
+def format_date(at):
+    return datetime.fromtimestamp(at).strftime(DATE_FORMAT)
+
+
+class Transaction:
+    # payers, on settlements only, maps each payer phone to [paise, payments]
+    __slots__ = ('at', 'amount', 'type', 'balance', 'counterparty', 'payments', 'payers')
+
+    def __init__(self, at, amount, type, balance, counterparty=None, payments=None, payers=None):
+        self.at = at
+        self.amount = amount
+        self.type = type
+        self.balance = balance
+        self.counterparty = counterparty
+        self.payments = payments
+        self.payers = payers
+
+    def to_row(self):
+        row = [self.at, self.amount, self.type, self.balance]
+        if self.counterparty is not None or self.payments is not None:
+            row.append(self.counterparty)
+        if self.payments is not None:
+            row += [self.payments, self.payers]
+        return row
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    def to_dict(self):
+        data = {
+            "date": format_date(self.at),
+            "amount": rupees(self.amount),
+            "type": self.type,
+            "balance": rupees(self.balance)
+        }
+        if self.counterparty is not None:
+            data['from'] = self.counterparty
+        if self.payments is not None:
+            data['payments'] = self.payments
+            data['payers'] = {phone: {"amount": rupees(amount), "payments": payments}
+                              for phone, (amount, payments) in self.payers.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        payers = data.get('payers')
+        if payers is not None:
+            payers = {phone: [parse_amount(payer['amount']), payer['payments']]
+                      for phone, payer in payers.items()}
+        return cls(parse_date(data['date']), parse_amount(data['amount']), data['type'],
+                   parse_amount(data['balance']), data.get('from'), data.get('payments'), payers)
+
+
+class Account:
+    # A user, or the admin account (which has a password and no fingerprint).
+    # archived counts the oldest transactions moved to the TransactionArchive.
+    __slots__ = ('phone', 'name', 'balance', 'transactions', 'fingerprint_id', 'password', 'archived')
+
+    def __init__(self, phone, name, balance, transactions=None, fingerprint_id=None, password=None,
+                 archived=0):
+        self.phone = phone
+        self.name = name
+        self.balance = balance
+        self.transactions = transactions if transactions is not None else []
+        self.fingerprint_id = fingerprint_id
+        self.password = password
+        self.archived = archived
+
+    def to_record(self):
+        # Snapshot and journal form
+        record = {
+            "phone": self.phone,
+            "name": self.name,
+            "balance": self.balance,
+            "transactions": [transaction.to_row() for transaction in self.transactions]
+        }
+        if self.fingerprint_id is not None:
+            record['fingerprint_id'] = self.fingerprint_id
+        if self.password is not None:
+            record['password'] = self.password
+        if self.archived:
+            record['archived'] = self.archived
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record['phone'], record['name'], record['balance'],
+                   [Transaction.from_row(row) for row in record['transactions']],
+                   record.get('fingerprint_id'), record.get('password'), record.get('archived', 0))
+
+    def to_dict(self, transactions=True):
+        data = {
+            "phone": self.phone,
+            "name": self.name,
+            "balance": rupees(self.balance)
+        }
+        if transactions:
+            data['transactions'] = [transaction.to_dict() for transaction in self.transactions]
+        if self.fingerprint_id is not None:
+            data['fingerprint_id'] = self.fingerprint_id
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        # The bank_data.json shape from before integer amounts
+        return cls(data['phone'], data['name'], parse_amount(data['balance']),
+                   [Transaction.from_dict(transaction) for transaction in data.get('transactions', [])],
+                   data.get('fingerprint_id'), data.get('password'), data.get('archived', 0))
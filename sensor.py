@@ -0,0 +1,329 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import serial
+import serial.tools.list_ports
+
+import config
+import metrics
+import protocol
+import tracing
+from protocol import Ack, Disconnected, Error, Failed, Found, NoFinger, NotFound, Ready, Stored
+
+CONNECT_SECONDS = metrics.Histogram(
+    'fingerpay_sensor_connect_seconds', 'Time per phase of connecting to the bridge', ['phase'])
+CONNECT_FAILURES = metrics.Counter(
+    'fingerpay_sensor_connect_failures_total', 'Bridge connections that failed')
+COMMAND_SECONDS = metrics.Histogram(
+    'fingerpay_sensor_command_seconds', 'Sensor command round-trip time', ['command', 'outcome'])
+
+
+def find_arduino_port():
+    if config.SERIAL_PORT:
+        print(f"Using configured port: {config.SERIAL_PORT}")
+        return config.SERIAL_PORT
+
+    ports = list(serial.tools.list_ports.comports())
+
+    if not ports:
+        print("No serial ports found!")
+        return None
+
+    print("\nAvailable ports:")
+    for port in ports:
+        print(f"Port: {port.device}")
+        print(f"Description: {port.description}")
+        print(f"Hardware ID: {port.hwid}")
+        print("-" * 50)
+
+    # Look for Arduino or CH340
+    for port in ports:
+        if is_bridge(port):
+            print(f"\nFound likely Arduino port: {port.device}")
+            return port.device
+
+    print(f"\nNo Arduino-specific port found, using first available: {ports[0].device}")
+    return ports[0].device
+
+
+def is_bridge(port):
+    return any(id in port.description.lower() for id in ["ch340", "arduino", "usb serial"])
+
+
+def find_bridge_ports():
+    # Every attached bridge as (key, device). The key is the USB serial number
+    # where there is one, so it survives the bridge moving to another port.
+    if config.SERIAL_PORTS:
+        return [(port, port) for port in config.SERIAL_PORTS]
+
+    ports = list(serial.tools.list_ports.comports())
+    bridges = [port for port in ports if is_bridge(port)]
+    if not bridges and ports:
+        print(f"No Arduino-specific port found, using first available: {ports[0].device}")
+        bridges = ports[:1]
+    return [(port.serial_number or port.device, port.device) for port in bridges]
+
+
+# Unanswered M probes in a row before a connection stops trying M. One slow
+# acknowledgement does not make firmware look like it predates M.
+MATCH_PROBES = 3
+
+# Metric label for how a command ended, "timeout" when nothing came back
+OUTCOMES = {Found: 'found', NotFound: 'not_found', Stored: 'stored', Failed: 'failed', Error: 'error'}
+
+
+def outcome_of(event):
+    return OUTCOMES.get(type(event), 'timeout')
+
+
+def accept_match(fingerprint_id, confidence):
+    # Applies the FINGERPAY_MATCH_CONFIDENCE floor, the same for the web app
+    # and the kiosk CLI; a weak match counts as no match
+    if fingerprint_id is not None and confidence < config.MATCH_CONFIDENCE:
+        print(f"Match confidence {confidence} is below {config.MATCH_CONFIDENCE}")
+        return None, confidence
+    return fingerprint_id, confidence
+
+
+class SensorConnection:
+    # Keeps one serial connection to the bridge open across requests. The port
+    # is opened and the Arduino reset once, then reused until an operation
+    # fails, after which the next session reconnects. A reader thread blocks on
+    # the port and turns each line into an event for the waiting caller.
+
+    def __init__(self, port=None, baudrate=protocol.DEFAULT_BAUDRATE, ready_timeout=5,
+                 fast_baudrate=config.SENSOR_BAUDRATE, compact=config.SENSOR_COMPACT):
+        self.port = port
+        self.baudrate = baudrate
+        self.ready_timeout = ready_timeout
+        self.fast_baudrate = fast_baudrate
+        self.compact = compact
+        self.ser = None
+        self.events = queue.Queue()
+        self.lock = threading.RLock()
+        # Whether the firmware knows M, unknown until first tried, and how
+        # many probes in a row went unanswered
+        self.matches_by_id = None
+        self.match_misses = 0
+
+    @property
+    def is_open(self):
+        return self.ser is not None and self.ser.is_open
+
+    def connect(self):
+        port = self.port or find_arduino_port()
+        if not port:
+            raise serial.SerialException("No ports available!")
+
+        print(f"Opening port {port}...")
+        started = time.perf_counter()
+        try:
+            with tracing.span('serial_open'):
+                ser = self.open(port)
+        except Exception:
+            CONNECT_FAILURES.inc()
+            raise
+        CONNECT_SECONDS.observe(time.perf_counter() - started, phase='open')
+
+        # Reset the device and wait for the firmware banner instead of a fixed sleep
+        print("Resetting device...")
+        started = time.perf_counter()
+        try:
+            ser.dtr = False
+            time.sleep(0.1)
+            ser.reset_input_buffer()
+            ser.dtr = True
+        except OSError:
+            # Virtual ports have no modem control lines
+            print("Port does not support DTR reset")
+
+        self.ser = ser
+        self.events = queue.Queue()
+        self.matches_by_id = None
+        self.match_misses = 0
+        threading.Thread(target=self.read_loop, args=(ser, self.events),
+                         name=f'sensor-reader-{port}', daemon=True).start()
+        try:
+            self.wait_until_ready()
+            ready = time.perf_counter()
+            CONNECT_SECONDS.observe(ready - started, phase='reset')
+            tracing.add('arduino_reset', started, ready)
+            with tracing.span('link_negotiate'):
+                self.negotiate()
+            CONNECT_SECONDS.observe(time.perf_counter() - ready, phase='negotiate')
+        except BaseException:
+            CONNECT_FAILURES.inc()
+            self.close()
+            raise
+
+    def open(self, port):
+        return serial.Serial(
+            port=port,
+            baudrate=self.baudrate,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            timeout=1,
+            write_timeout=1,
+            xonxoff=False,    # disable software flow control
+            rtscts=False,     # disable hardware (RTS/CTS) flow control
+            dsrdtr=False      # disable hardware (DSR/DTR) flow control
+        )
+
+    def read_loop(self, ser, events):
+        # Each connection has its own reader and queue, a reader outliving its
+        # connection just exits
+        while self.ser is ser:
+            try:
+                raw = ser.readline()
+            except Exception as e:
+                if self.ser is ser:
+                    events.put(Disconnected(str(e)))
+                return
+
+            line = raw.decode('utf-8', errors='replace').strip()
+            if not line:
+                continue
+            event = protocol.parse_line(line)
+            if not isinstance(event, NoFinger):
+                print(f"Received: {line}")
+            events.put(event)
+
+    def wait_until_ready(self):
+        event = self.wait_for((Ready, Failed), self.ready_timeout)
+        if isinstance(event, Failed):
+            raise serial.SerialException(event.reason)
+        if event is None:
+            print("No ready banner from the bridge, continuing anyway")
+
+    def negotiate(self):
+        # Older firmware ignores B and C, the link then stays at the default
+        # baud rate in verbose mode
+        switched = False
+        if self.fast_baudrate != self.ser.baudrate and self.fast_baudrate in protocol.SUPPORTED_BAUDRATES:
+            ack = self.command(protocol.baud_command(self.fast_baudrate), Ack, 1)
+            if ack is not None and ack.command == 'B':
+                self.ser.flush()
+                time.sleep(0.05)  # Let the bridge reopen its port at the new rate
+                self.ser.baudrate = self.fast_baudrate
+                switched = True
+
+        if self.compact or switched:
+            # Also serves as a ping at the new baud rate
+            ack = self.command(protocol.mode_command(self.compact), Ack, 1)
+            if switched and (ack is None or ack.command != 'C'):
+                raise serial.SerialException(f"Bridge did not answer at {self.fast_baudrate} baud")
+
+    def wait_for(self, until, timeout, on_event=None):
+        # Returns the first event of a type in until, or None at the deadline
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                return None
+
+            if isinstance(event, Disconnected):
+                raise serial.SerialException(event.reason)
+            if on_event is not None:
+                on_event(event)
+            if isinstance(event, until):
+                return event
+
+    def command(self, data, until, timeout, on_event=None):
+        # Must be called inside session(). Leftovers from an earlier command
+        # are dropped.
+        while not self.events.empty():
+            self.note_match_ack(self.events.get_nowait())
+        self.ser.write(data)
+        self.ser.flush()
+        return self.wait_for(until, timeout, on_event)
+
+    def note_match_ack(self, event):
+        # An M acknowledgement, even one that came too late, shows the
+        # firmware knows M
+        if isinstance(event, Ack) and event.command == 'M':
+            self.matches_by_id = True
+            self.match_misses = 0
+
+    def verify(self, timeout=10, on_event=None, expected_id=None):
+        # With an expected ID the bridge matches the finger against that one
+        # stored template (M), which takes the same time however many users are
+        # enrolled. Older firmware ignores M, the library is then searched (V).
+        # Only after MATCH_PROBES unanswered probes in a row is M given up on
+        # for this connection; a late acknowledgement counts as an answer.
+        results = (Found, NotFound, Failed, Error)
+        with self.session():
+            started = time.perf_counter()
+            event = None
+            command = 'verify'
+            if expected_id is not None and self.matches_by_id is not False:
+                event = self.command(protocol.match_command(expected_id), (Ack,) + results, 1, on_event)
+                if event is None:
+                    self.match_misses += 1
+                    if self.match_misses >= MATCH_PROBES:
+                        print("Bridge does not support matching by ID, searching instead")
+                        self.matches_by_id = False
+                    else:
+                        print("No answer to matching by ID, searching instead")
+                else:
+                    self.matches_by_id = True
+                    self.match_misses = 0
+                    command = 'match'
+                    if isinstance(event, Ack):
+                        event = self.wait_for(results, timeout, on_event)
+            if command == 'verify' and event is None:
+                def watch(event):
+                    self.note_match_ack(event)
+                    if on_event is not None:
+                        on_event(event)
+                event = self.command(protocol.VERIFY_COMMAND, results, timeout, watch)
+            finished = time.perf_counter()
+            COMMAND_SECONDS.observe(finished - started, command=command, outcome=outcome_of(event))
+            tracing.add('sensor_wait', started, finished)
+
+        if isinstance(event, Found):
+            return event.fingerprint_id, event.confidence
+        if event is None:
+            print("Verification timed out")
+        return None, 0
+
+    def enroll(self, finger_id, timeout=30, on_event=None):
+        with self.session():
+            started = time.perf_counter()
+            event = self.command(protocol.enroll_command(finger_id), (Stored, Failed), timeout, on_event)
+            finished = time.perf_counter()
+            COMMAND_SECONDS.observe(finished - started, command='enroll', outcome=outcome_of(event))
+            tracing.add('enroll_wait', started, finished)
+            if event is None:
+                # The firmware is still waiting for a finger, reset it on next use
+                print("Enrollment timed out")
+                self.close()
+
+        return isinstance(event, Stored)
+
+    def close(self):
+        ser, self.ser = self.ser, None
+        if ser is not None:
+            try:
+                ser.close()
+            except:
+                pass
+
+    @contextmanager
+    def session(self):
+        # One command at a time on the port. Any error drops the connection so
+        # the next session starts from a freshly reset bridge.
+        with self.lock:
+            try:
+                if not self.is_open:
+                    self.connect()
+                yield self
+            except BaseException:
+                self.close()
+                raise
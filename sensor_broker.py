@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import tracing
+from broker_client import SensorBrokerClient
+from jobs import IdempotencyCache
+from sensor_pool import SensorPool
+from slots import SlotAllocator
+
+# A serial port can only be opened by one process. The sensor broker owns
+# every fingerprint bridge and serves verify and enroll requests over a Unix
+# socket, so the web app can run as several worker processes, each talking to
+# it through broker_client.SensorBrokerClient. It also keeps what those
+# workers must agree on: free fingerprint slots, job status and payment
+# idempotency keys.
+#
+# Requests and replies are JSON lines tagged with the request's ID. Sensor
+# requests run on their own thread, so one connection carries many at once;
+# progress ("acquired", "event") is streamed before the "result" or "error".
+# Linux/macOS only (Unix sockets).
+# Usage: python sensor_broker.py [--socket sensor_broker.sock] [--status]
+
+DEFAULT_SOCKET = 'sensor_broker.sock'
+
+# Long running requests, each on its own thread
+SENSOR_OPS = ('verify', 'enroll')
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    # One web worker's connection
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        self.reserved = set()   # slots reserved over this connection
+        try:
+            for line in self.rfile:
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                if request.get('op') in SENSOR_OPS:
+                    threading.Thread(target=self.run, args=(request,), daemon=True).start()
+                else:
+                    self.run(request)
+        except OSError:
+            pass
+        finally:
+            # A worker that went away mid-registration never commits its slot
+            for slot in self.reserved:
+                self.server.slots.release(slot)
+
+    def run(self, request):
+        request_id = request.get('id')
+        trace = tracing.Trace(request.get('op'))
+        try:
+            with trace.activate():
+                result = self.server.dispatch(self, request)
+        except Exception as e:
+            self.send({'id': request_id, 'error': str(e), 'type': type(e).__name__})
+        else:
+            reply = {'id': request_id, 'result': result}
+            if trace.spans:
+                reply['spans'] = trace.spans
+            self.send(reply)
+
+    def send(self, message):
+        data = (json.dumps(message, separators=(',', ':')) + '\n').encode()
+        try:
+            with self.write_lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+        except OSError:
+            pass  # The worker went away, its request still ran
+
+
+class SensorBroker(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, pool, slots, keep_seconds=300):
+        self.pool = pool
+        self.slots = slots
+        self.keep_seconds = keep_seconds
+        self.jobs = OrderedDict()   # job ID -> (expires, job dict)
+        self.jobs_lock = threading.Lock()
+        self.idempotency = IdempotencyCache(config.IDEMPOTENCY_KEYS, config.IDEMPOTENCY_TTL)
+        super().__init__(path, BrokerHandler)
+
+    def dispatch(self, handler, request):
+        op = getattr(self, f"op_{request.get('op')}", None)
+        if op is None:
+            raise ValueError(f"Unknown request: {request.get('op')}")
+        return op(handler, request)
+
+    # Sensors
+
+    def op_verify(self, handler, request):
+        request_id = request['id']
+        return self.pool.verify(
+            request.get('expected_id'), timeout=request.get('timeout', 10),
+            on_acquire=lambda label: handler.send({'id': request_id, 'acquired': label}),
+            on_event=lambda event: handler.send({'id': request_id, 'event': [type(event).__name__, list(event)]}))
+
+    def op_enroll(self, handler, request):
+        request_id = request['id']
+        return self.pool.enroll(
+            request['finger_id'], timeout=request.get('timeout', 30),
+            on_acquire=lambda label: handler.send({'id': request_id, 'acquired': label}),
+            on_event=lambda event: handler.send({'id': request_id, 'event': [type(event).__name__, list(event)]}))
+
+    def op_hello(self, handler, request):
+        self.slots.mark_used(request.get('used', ()))
+        return None
+
+    def op_status(self, handler, request):
+        return {'sensors': self.pool.status(), 'slots': self.slots.status()}
+
+    # Fingerprint slots
+
+    def op_slot_reserve(self, handler, request):
+        slot = self.slots.reserve()
+        handler.reserved.add(slot)
+        return slot
+
+    def op_slot_commit(self, handler, request):
+        # Also marks slots reserved before a broker restart
+        self.slots.commit(request['slot'])
+        self.slots.mark_used([request['slot']])
+        handler.reserved.discard(request['slot'])
+        return None
+
+    def op_slot_release(self, handler, request):
+        self.slots.release(request['slot'])
+        handler.reserved.discard(request['slot'])
+        return None
+
+    def op_slot_status(self, handler, request):
+        return self.slots.status()
+
+    # Job status, so any worker can answer a poll for any job
+
+    def op_job_put(self, handler, request):
+        job = request['job']
+        with self.jobs_lock:
+            self.jobs.pop(job['job_id'], None)
+            self.jobs[job['job_id']] = (time.monotonic() + self.keep_seconds, job)
+            now = time.monotonic()
+            while self.jobs:
+                job_id, (expires, _) = next(iter(self.jobs.items()))
+                if expires > now:
+                    break
+                del self.jobs[job_id]
+        return None
+
+    def op_job_get(self, handler, request):
+        with self.jobs_lock:
+            entry = self.jobs.get(request['job_id'])
+        return entry[1] if entry is not None else None
+
+    # Payment idempotency keys, mapped to job IDs
+
+    def op_idempotency_get(self, handler, request):
+        return self.idempotency.get(request['key'], tuple(request['request']))
+
+    def op_idempotency_setdefault(self, handler, request):
+        return self.idempotency.setdefault(request['key'], tuple(request['request']),
+                                           lambda: request['job_id'])
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    try:
+        SensorBrokerClient(path).status()
+    except (ConnectionError, TimeoutError):
+        os.remove(path)
+        return
+    sys.exit(f"A sensor broker is already running on {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Owns the fingerprint bridges for all web worker processes")
+    parser.add_argument('--socket', default=config.SENSOR_BROKER or DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument('--status', action='store_true', help="print a running broker's status and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        print(json.dumps(SensorBrokerClient(args.socket).status(), indent=4))
+        return
+
+    remove_stale_socket(args.socket)
+    pool = SensorPool()
+    # Workers add the IDs in their ledger when they connect
+    slots = SlotAllocator(config.SENSOR_CAPACITY)
+    server = SensorBroker(args.socket, pool, slots)
+    os.chmod(args.socket, 0o660)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print(f"Sensor broker listening on {args.socket} with {len(pool)} scanner(s)")
+    print(f"Run the app with FINGERPAY_SENSOR_BROKER={args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import tracing
+from sensor import SensorConnection, find_bridge_ports
+
+# A bridge that fails is skipped for this long, unless nothing else is free
+UNHEALTHY_SECONDS = 30
+
+
+class PooledSensor:
+    def __init__(self, key, label, connection):
+        self.key = key
+        self.label = label
+        self.connection = connection
+        self.busy = False
+        self.failures = 0
+        self.unhealthy_until = 0
+        self.last_used = 0
+
+    @property
+    def state(self):
+        if self.busy:
+            return 'busy'
+        if self.unhealthy_until > time.time():
+            return 'unhealthy'
+        return 'idle'
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'label': self.label,
+            'port': self.connection.port,
+            'state': self.state,
+            'failures': self.failures
+        }
+
+
+class SensorPool:
+    # Every attached bridge, with busy/idle/unhealthy state. acquire() hands
+    # out a free bridge, preferring healthy and least recently used ones.
+    #
+    # Templates live on the bridge that enrolled them, so each fingerprint ID
+    # is assigned to `replicas` bridges when it is enrolled, and verification
+    # for that ID is routed to one of them. IDs enrolled before the pool
+    # existed have no assignment and may use any bridge.
+
+    def __init__(self, ports=None, replicas=config.SENSOR_REPLICAS,
+                 assignments_file=config.SENSOR_ASSIGNMENTS_FILE):
+        self.replicas = replicas
+        self.assignments_file = assignments_file
+        self.condition = threading.Condition()
+        self.sensors = []
+        self.add_ports(ports if ports is not None else find_bridge_ports())
+        self.assignments = self.load_assignments()
+
+    def __len__(self):
+        return len(self.sensors)
+
+    def add_ports(self, ports):
+        known = {sensor.key for sensor in self.sensors}
+        for key, device in ports:
+            if key not in known:
+                label = f"scanner {len(self.sensors) + 1}"
+                self.sensors.append(PooledSensor(key, label, SensorConnection(device)))
+                print(f"Registered {label} on {device}")
+
+    def load_assignments(self):
+        if not os.path.exists(self.assignments_file):
+            return {}
+        with open(self.assignments_file, 'r') as file:
+            # An empty list never held a template, treat it as unassigned
+            return {int(id): keys for id, keys in json.load(file).items() if keys}
+
+    def save_assignments(self):
+        tmp_file = self.assignments_file + '.tmp'
+        with open(tmp_file, 'w') as file:
+            json.dump(self.assignments, file, indent=4)
+        os.replace(tmp_file, self.assignments_file)
+
+    def holders(self, fingerprint_id):
+        # Keys of the bridges holding this template, None if any bridge will do
+        with self.condition:
+            return self.assignments.get(fingerprint_id)
+
+    def assign(self, fingerprint_id):
+        # Picks the bridges with the fewest templates to hold a new enrollment
+        with self.condition:
+            if not self.sensors:
+                self.add_ports(find_bridge_ports())
+            load = {sensor.key: 0 for sensor in self.sensors}
+            for keys in self.assignments.values():
+                for key in keys:
+                    if key in load:
+                        load[key] += 1
+            chosen = sorted(load, key=load.get)[:max(self.replicas, 1)]
+            if not chosen:
+                raise LookupError("No fingerprint sensor connected")
+            self.assignments[fingerprint_id] = chosen
+            self.save_assignments()
+            return list(chosen)
+
+    def unassign(self, fingerprint_id):
+        with self.condition:
+            if self.assignments.pop(fingerprint_id, None) is not None:
+                self.save_assignments()
+
+    def pick(self, keys):
+        now = time.time()
+        free = [sensor for sensor in self.sensors
+                if not sensor.busy and (keys is None or sensor.key in keys)]
+        healthy = [sensor for sensor in free if sensor.unhealthy_until <= now]
+        candidates = healthy or free
+        if not candidates:
+            return None
+        return min(candidates, key=lambda sensor: sensor.last_used)
+
+    @contextmanager
+    def acquire(self, keys=None, timeout=30):
+        with self.condition:
+            if not self.sensors:
+                # Bridges plugged in after start-up
+                self.add_ports(find_bridge_ports())
+            if not any(keys is None or sensor.key in keys for sensor in self.sensors):
+                raise LookupError("No fingerprint sensor holds this fingerprint")
+
+            deadline = time.monotonic() + timeout
+            with tracing.span('sensor_acquire'):
+                sensor = self.pick(keys)
+                while sensor is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("All fingerprint sensors are busy")
+                    self.condition.wait(remaining)
+                    sensor = self.pick(keys)
+            sensor.busy = True
+
+        try:
+            yield sensor
+        except Exception:
+            sensor.failures += 1
+            sensor.unhealthy_until = time.time() + UNHEALTHY_SECONDS
+            raise
+        else:
+            sensor.failures = 0
+            sensor.unhealthy_until = 0
+        finally:
+            with self.condition:
+                sensor.busy = False
+                sensor.last_used = time.monotonic()
+                self.condition.notify_all()
+
+    def verify(self, expected_id=None, timeout=10, on_acquire=None, on_event=None):
+        # Routed to a free bridge that holds the expected user's template.
+        # on_acquire is called with the bridge's label.
+        with self.acquire(self.holders(expected_id)) as sensor:
+            if on_acquire is not None:
+                on_acquire(sensor.label)
+            print(f"Sending verify command to {sensor.label}...")
+            return sensor.connection.verify(timeout=timeout, on_event=on_event, expected_id=expected_id)
+
+    def enroll(self, finger_id, timeout=30, on_acquire=None, on_event=None):
+        # Enrolls on every bridge assigned to hold this ID, one after another
+        try:
+            for key in self.assign(finger_id):
+                with self.acquire([key]) as sensor:
+                    if on_acquire is not None:
+                        on_acquire(sensor.label)
+                    print(f"Sending enroll command for ID {finger_id} to {sensor.label}...")
+                    if not sensor.connection.enroll(finger_id, timeout=timeout, on_event=on_event):
+                        self.unassign(finger_id)
+                        return False
+            return True
+        except Exception:
+            self.unassign(finger_id)
+            raise
+
+    def status(self):
+        return [sensor.to_dict() for sensor in self.sensors]
+
+    def close(self):
+        for sensor in self.sensors:
+            sensor.connection.close()
@@ -0,0 +1,255 @@
+import argparse
+import os
+import pty
+import random
+import select
+import threading
+import time
+
+import protocol
+
+# Pretends to be fingerprint_arduino_bridge.ino on a pseudo-terminal, so the
+# app can run and be load tested without hardware. Point the app at it with
+# FINGERPAY_SERIAL_PORT=<printed device path>.
+#
+# Like an Uno, the simulator "resets" every time the port is opened: it drops
+# back to verbose mode and prints the boot banner.
+
+# Line noise the host has to skip over without misreading it as a response
+NOISE_LINES = ["", ".", "?", "\x00\x7f", "~~~"]
+
+
+class SimulatedSensor:
+    def __init__(self, enrolled=(), finger=None, match_latency=0.5, enroll_latency=1.0,
+                 failure_rate=0.0, no_match_rate=0.0, noise_rate=0.0, capacity=127, search_cost=0.0,
+                 firmware_match=True, match_ack_delay=0.0, seed=None):
+        self.enrolled = set(enrolled)
+        # The finger placed on the scanner: an enrolled ID, None for a random
+        # enrolled ID, or -1 for an unknown finger
+        self.finger = finger
+        self.match_latency = match_latency
+        self.enroll_latency = enroll_latency
+        self.failure_rate = failure_rate
+        self.no_match_rate = no_match_rate
+        self.noise_rate = noise_rate
+        self.capacity = capacity
+        # Extra seconds per enrolled template for a library search (V), a 1:1
+        # match (M) only ever compares one. firmware_match=False behaves like
+        # firmware from before M existed.
+        self.search_cost = search_cost
+        self.firmware_match = firmware_match
+        # Seconds before M is acknowledged, like a bridge still busy with
+        # something else
+        self.match_ack_delay = match_ack_delay
+        self.random = random.Random(seed)
+
+        self.compact = False
+        self.buffer = b''
+        self.running = False
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        # Only the host keeps the slave side open, so we can see it connect
+        os.close(slave)
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self.run, name='sensor-simulator', daemon=True).start()
+        return self.port
+
+    def stop(self):
+        self.running = False
+
+    # Port handling
+
+    def host_connected(self):
+        # The master reports a hangup while nobody has the slave open
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+        return not any(mask & select.POLLHUP for _, mask in poller.poll(0))
+
+    def boot(self):
+        self.compact = False
+        self.buffer = b''
+        time.sleep(0.2)  # Host flushes its buffers right after opening
+        self.println("Found fingerprint sensor!")
+        self.println("Ready to receive commands:")
+        self.println("E - Enroll new fingerprint")
+        self.println("V - Verify/match fingerprint")
+        if self.firmware_match:
+            self.println("M - Match against one stored ID, e.g. M5")
+        self.println("B - Set baud rate, e.g. B115200")
+        self.println("C - Compact responses on (C1) or off (C0)")
+
+    def println(self, line):
+        try:
+            os.write(self.master, line.encode() + b'\r\n')
+        except OSError:
+            pass  # Host went away mid-response
+
+    def respond(self, verbose, compact):
+        if not self.compact:
+            self.println(verbose)
+        elif compact is not None:
+            self.println(compact)
+
+    def noise(self):
+        if self.random.random() < self.noise_rate:
+            self.println(self.random.choice(NOISE_LINES))
+
+    def read_byte(self, timeout):
+        if not self.buffer:
+            ready, _, _ = select.select([self.master], [], [], timeout)
+            if not ready:
+                return None
+            try:
+                self.buffer += os.read(self.master, 64)
+            except OSError:
+                return None
+        byte, self.buffer = self.buffer[:1], self.buffer[1:]
+        return byte
+
+    def parse_int(self):
+        # Mirrors Serial.parseInt() with the firmware's 100ms timeout
+        digits = b''
+        while True:
+            byte = self.read_byte(0.1)
+            if byte is None:
+                break
+            if byte.isdigit():
+                digits += byte
+            elif digits or byte in b'\r\n':
+                break
+        return int(digits or 0)
+
+    def run(self):
+        connected = False
+        while self.running:
+            if not self.host_connected():
+                connected = False
+                time.sleep(0.05)
+                continue
+            if not connected:
+                connected = True
+                self.boot()
+
+            command = self.read_byte(0.1)
+            if command == b'V':
+                self.respond("Starting verification...", "K V")
+                self.verify()
+            elif command == b'M' and self.firmware_match:
+                finger_id = self.parse_int()
+                time.sleep(self.match_ack_delay)
+                self.respond(f"Starting verification of ID #{finger_id}", f"K M {finger_id}")
+                self.match(finger_id)
+            elif command == b'E':
+                finger_id = self.parse_int()
+                self.respond(f"Starting enrollment for ID #{finger_id}", f"K E {finger_id}")
+                self.enroll(finger_id)
+            elif command == b'B':
+                baudrate = self.parse_int()
+                if baudrate in protocol.SUPPORTED_BAUDRATES:
+                    # A pty has no real line speed, only the handshake matters
+                    self.respond(f"Switching to {baudrate} baud", f"K B {baudrate}")
+            elif command == b'C':
+                self.compact = self.parse_int() != 0
+                self.println(f"K C {int(self.compact)}")
+
+    # Sensor operations
+
+    def presented_finger(self):
+        if self.finger is None:
+            return self.random.choice(sorted(self.enrolled)) if self.enrolled else -1
+        return self.finger
+
+    def verify(self):
+        time.sleep(self.match_latency + self.search_cost * len(self.enrolled))
+        self.noise()
+        finger = self.presented_finger()
+        if self.random.random() < self.failure_rate:
+            self.respond("Unknown error", "W UNKNOWN")
+        elif finger in self.enrolled and self.random.random() >= self.no_match_rate:
+            self.found(finger)
+        else:
+            self.respond("Did not find a match", "N")
+
+    def match(self, finger_id):
+        if finger_id not in self.enrolled:
+            self.respond("Failed to load template", "X LOAD")
+            return
+        self.respond("Place your finger on the sensor", "P F")
+        time.sleep(self.match_latency)
+        self.noise()
+        if self.random.random() < self.failure_rate:
+            self.respond("Unknown error", "W UNKNOWN")
+        elif self.presented_finger() == finger_id and self.random.random() >= self.no_match_rate:
+            self.found(finger_id)
+        else:
+            self.respond("Did not find a match", "N")
+
+    def found(self, finger_id):
+        confidence = self.random.randint(50, 250)
+        self.respond(f"Found ID #{finger_id} with confidence of {confidence}",
+                     f"F {finger_id} {confidence}")
+
+    def enroll(self, finger_id):
+        self.respond("Waiting for valid finger to enroll", "P W")
+        for _ in range(self.random.randint(0, 3)):
+            self.respond(".", None)
+            self.noise()
+        self.respond("Image taken", "I")
+        self.respond("Remove finger", "P R")
+        time.sleep(self.enroll_latency / 2)
+        self.respond("Place same finger again", "P A")
+        time.sleep(self.enroll_latency / 2)
+
+        if self.random.random() < self.failure_rate:
+            self.respond("Failed to create model", "X MODEL")
+        elif not 0 <= finger_id < self.capacity:
+            self.respond("Failed to store model", "X STORE")
+        else:
+            self.enrolled.add(finger_id)
+            self.respond("Stored!", "S")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated fingerprint bridge on a pseudo-terminal")
+    parser.add_argument('--enrolled', default='', help="comma separated IDs already stored, e.g. 0,1,2")
+    parser.add_argument('--finger', type=int, default=None,
+                        help="ID of the finger on the scanner, -1 for unknown (default: random enrolled ID)")
+    parser.add_argument('--match-latency', type=float, default=0.5, help="seconds per verification")
+    parser.add_argument('--enroll-latency', type=float, default=1.0, help="seconds per enrollment")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="chance of a sensor error")
+    parser.add_argument('--no-match-rate', type=float, default=0.0, help="chance an enrolled finger is not matched")
+    parser.add_argument('--noise-rate', type=float, default=0.0, help="chance of a junk line in a response")
+    parser.add_argument('--capacity', type=int, default=127, help="template slots on the sensor")
+    parser.add_argument('--search-cost', type=float, default=0.0,
+                        help="extra seconds per enrolled template when searching the library")
+    parser.add_argument('--no-match-command', action='store_true', help="behave like firmware without M")
+    args = parser.parse_args()
+
+    enrolled = [int(id) for id in args.enrolled.split(',') if id.strip()]
+    simulator = SimulatedSensor(
+        enrolled=enrolled,
+        finger=args.finger,
+        match_latency=args.match_latency,
+        enroll_latency=args.enroll_latency,
+        failure_rate=args.failure_rate,
+        no_match_rate=args.no_match_rate,
+        noise_rate=args.noise_rate,
+        capacity=args.capacity,
+        search_cost=args.search_cost,
+        firmware_match=not args.no_match_command
+    )
+    port = simulator.start()
+    print(f"Simulated sensor on {port}")
+    print(f"Run the app with FINGERPAY_SERIAL_PORT={port}")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
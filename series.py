@@ -0,0 +1,90 @@
+from array import array
+
+import config
+from records import format_date, rupees
+
+
+class BalanceSeries:
+    # Balance history kept as compact epoch-second and paise arrays, plus a
+    # running min/max summary of at most budget // 4 buckets. When the buckets
+    # fill up, neighbours are merged and the bucket width doubles, so appends
+    # are amortized O(1) and points() is O(budget) however long the history.
+
+    def __init__(self, budget=config.DASHBOARD_POINTS):
+        self.times = array('q')
+        self.balances = array('q')
+        self.max_buckets = max(budget // 4, 1)
+        self.bucket_size = 1
+        # Each bucket is [count, first, low, high, last], points are (time, balance)
+        self.buckets = []
+
+    @classmethod
+    def from_transactions(cls, transactions, budget=config.DASHBOARD_POINTS):
+        series = cls(budget)
+        for transaction in transactions:
+            series.append(transaction.at, transaction.balance)
+        return series
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, timestamp, balance):
+        self.times.append(timestamp)
+        self.balances.append(balance)
+
+        point = (timestamp, balance)
+        if self.buckets and self.buckets[-1][0] < self.bucket_size:
+            bucket = self.buckets[-1]
+            bucket[0] += 1
+            if balance < bucket[2][1]:
+                bucket[2] = point
+            if balance > bucket[3][1]:
+                bucket[3] = point
+            bucket[4] = point
+        else:
+            self.buckets.append([1, point, point, point, point])
+            if len(self.buckets) > self.max_buckets:
+                self.merge_buckets()
+
+    def merge_buckets(self):
+        merged = []
+        for i in range(0, len(self.buckets), 2):
+            pair = self.buckets[i:i + 2]
+            merged.append([
+                sum(bucket[0] for bucket in pair),
+                pair[0][1],
+                min((bucket[2] for bucket in pair), key=lambda point: point[1]),
+                max((bucket[3] for bucket in pair), key=lambda point: point[1]),
+                pair[-1][4]
+            ])
+        self.buckets = merged
+        self.bucket_size *= 2
+
+    def points(self):
+        # Downsampled (times, balances): each bucket's first, min, max and last
+        # point in time order, which keeps the envelope of the line intact
+        times = []
+        balances = []
+        for bucket in self.buckets:
+            for timestamp, balance in sorted(set(bucket[1:])):
+                times.append(timestamp)
+                balances.append(balance)
+        return times, balances
+
+
+def line_chart(times, balances, title):
+    # Plotly figure as plain JSON-ready data, drawn by plotly.js in the browser.
+    # Building it by hand keeps pandas and plotly out of the server process.
+    return {
+        'data': [{
+            'type': 'scatter',
+            'mode': 'lines',
+            'x': [format_date(t) for t in times],
+            'y': [rupees(balance) for balance in balances]
+        }],
+        'layout': {
+            'title': {'text': title},
+            'xaxis': {'title': {'text': 'date'}},
+            'yaxis': {'title': {'text': 'balance'}}
+        }
+    }
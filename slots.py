@@ -0,0 +1,67 @@
+import threading
+
+import config
+
+
+class LibraryFull(Exception):
+    pass
+
+
+class SlotAllocator:
+    # Fingerprint template slots 0 .. capacity - 1 as a bitmap, built once from
+    # the IDs already in the ledger (which is what makes it persistent). The
+    # lowest free slot is found by scanning from a hint that only moves back
+    # when a slot is released, so allocation is O(1) amortized.
+    #
+    # A slot is reserved for the length of an enrollment, then either
+    # committed once the user is saved or released if enrollment fails.
+
+    def __init__(self, capacity=config.SENSOR_CAPACITY, used=()):
+        self.capacity = capacity
+        self.used = bytearray(capacity)
+        self.reserved = set()
+        self.free = capacity
+        self.lowest_free = 0
+        self.lock = threading.Lock()
+        self.mark_used(used)
+
+    def mark_used(self, used):
+        # IDs already taken in the ledger, also those saved by other processes
+        with self.lock:
+            for slot in used:
+                if 0 <= slot < self.capacity and not self.used[slot]:
+                    self.used[slot] = 1
+                    self.free -= 1
+                elif slot >= self.capacity:
+                    print(f"Fingerprint ID {slot} is beyond the sensor capacity of {self.capacity}")
+
+    def reserve(self):
+        with self.lock:
+            if not self.free:
+                raise LibraryFull(f"All {self.capacity} fingerprint slots are in use")
+            slot = self.used.index(0, self.lowest_free)
+            self.used[slot] = 1
+            self.free -= 1
+            self.lowest_free = slot + 1
+            self.reserved.add(slot)
+            return slot
+
+    def commit(self, slot):
+        with self.lock:
+            self.reserved.discard(slot)
+
+    def release(self, slot):
+        with self.lock:
+            if slot in self.reserved:
+                self.reserved.discard(slot)
+                self.used[slot] = 0
+                self.free += 1
+                self.lowest_free = min(self.lowest_free, slot)
+
+    def status(self):
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'free': self.free,
+                'reserved': len(self.reserved)
+            }
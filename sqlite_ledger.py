@@ -0,0 +1,425 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import config
+import metrics
+import tracing
+from archive import TransactionArchive
+from ledger import InsufficientBalance, Ledger, PhoneTaken, new_settlement
+from records import Account, Transaction, now
+from series import BalanceSeries
+
+# Amounts and balances are INTEGER paise, times INTEGER epoch seconds (see
+# records.py)
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    phone TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    fingerprint_id INTEGER UNIQUE,
+    password TEXT,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    balance INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL REFERENCES accounts(phone),
+    at INTEGER NOT NULL,
+    amount INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    counterparty TEXT,
+    balance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_phone ON transactions(phone, id);
+CREATE INDEX IF NOT EXISTS transactions_by_phone_at ON transactions(phone, at);
+CREATE TABLE IF NOT EXISTS pending_credits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL REFERENCES accounts(phone),
+    amount INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settlement_payers (
+    transaction_id INTEGER NOT NULL REFERENCES transactions(id),
+    phone TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    payments INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS settlement_payers_by_transaction ON settlement_payers(transaction_id);
+CREATE TABLE IF NOT EXISTS archived_counts (
+    phone TEXT PRIMARY KEY REFERENCES accounts(phone),
+    count INTEGER NOT NULL
+);
+PRAGMA user_version = 2;
+"""
+
+# Databases from before integer amounts have REAL rupees and TEXT dates in
+# "%Y-%m-%d %H:%M:%S" local time. Rebuilt in one transaction on first open.
+# The settlement and archive tables were added later and may be missing, so
+# they are created in the old layout first.
+MIGRATE_V1 = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS pending_credits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL REFERENCES accounts(phone),
+    amount REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settlement_payers (
+    transaction_id INTEGER NOT NULL REFERENCES transactions(id),
+    phone TEXT NOT NULL,
+    amount REAL NOT NULL,
+    payments INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived_counts (
+    phone TEXT PRIMARY KEY REFERENCES accounts(phone),
+    count INTEGER NOT NULL
+);
+DROP INDEX IF EXISTS transactions_by_phone;
+DROP INDEX IF EXISTS transactions_by_phone_date;
+DROP INDEX IF EXISTS settlement_payers_by_transaction;
+ALTER TABLE accounts RENAME TO old_accounts;
+ALTER TABLE transactions RENAME TO old_transactions;
+ALTER TABLE pending_credits RENAME TO old_pending_credits;
+ALTER TABLE settlement_payers RENAME TO old_settlement_payers;
+ALTER TABLE archived_counts RENAME TO old_archived_counts;
+""" + SCHEMA + """
+INSERT INTO accounts (phone, name, fingerprint_id, password, is_admin, balance)
+    SELECT phone, name, fingerprint_id, password, is_admin, CAST(ROUND(balance * 100) AS INTEGER)
+    FROM old_accounts;
+INSERT INTO transactions (id, phone, at, amount, type, counterparty, balance)
+    SELECT id, phone, CAST(strftime('%s', date, 'utc') AS INTEGER), CAST(ROUND(amount * 100) AS INTEGER),
+           type, counterparty, CAST(ROUND(balance * 100) AS INTEGER)
+    FROM old_transactions;
+INSERT INTO pending_credits (id, phone, amount)
+    SELECT id, phone, CAST(ROUND(amount * 100) AS INTEGER) FROM old_pending_credits;
+INSERT INTO settlement_payers (transaction_id, phone, amount, payments)
+    SELECT transaction_id, phone, CAST(ROUND(amount * 100) AS INTEGER), payments FROM old_settlement_payers;
+INSERT INTO archived_counts (phone, count) SELECT phone, count FROM old_archived_counts;
+DROP TABLE old_settlement_payers;
+DROP TABLE old_pending_credits;
+DROP TABLE old_archived_counts;
+DROP TABLE old_transactions;
+DROP TABLE old_accounts;
+COMMIT;
+"""
+
+ADMIN_PHONE = 'admin'
+
+TRANSACTION_SECONDS = metrics.Histogram(
+    'fingerpay_sqlite_transaction_seconds', 'Time from BEGIN IMMEDIATE to COMMIT')
+
+
+class SqliteLedger(Ledger):
+    # Accounts and transactions in a SQLite database in WAL mode, so readers
+    # never block the writer. Each thread gets its own connection. Several
+    # processes can share the database; the one thing cached in memory, the
+    # admin balance history, is brought up to date on reads of the admin
+    # account when PRAGMA data_version shows another connection committed.
+
+    def __init__(self, path=config.SQLITE_FILE, settle_every=config.SETTLE_EVERY,
+                 settle_seconds=config.SETTLE_SECONDS, hot_transactions=config.HOT_TRANSACTIONS,
+                 archive_dir=config.ARCHIVE_DIR):
+        self.path = path
+        self.hot_transactions = hot_transactions
+        self.archive = TransactionArchive(archive_dir)
+        self.local = threading.local()
+        self.migrate()
+        self.db.executescript(SCHEMA)
+
+        # A connection of its own, so data_version counts every commit made
+        # through the others, in this process or any other
+        self.watch = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.watch.row_factory = sqlite3.Row
+        self.watch_lock = threading.Lock()
+        self.data_version = None
+        self.series_row = 0
+        self.admin_series = BalanceSeries()
+        self.refresh()
+        self.init_settlement(settle_every, settle_seconds)
+
+    def migrate(self):
+        # On its own connection: table renames need foreign keys off
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(transactions)')]
+            if version < 2 and 'date' in columns:
+                print(f"Converting {self.path} to integer amounts and timestamps")
+                try:
+                    conn.executescript(MIGRATE_V1)
+                except sqlite3.Error:
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    raise
+        finally:
+            conn.close()
+
+    def refresh(self):
+        # Appends the admin transactions committed since the last call
+        with self.watch_lock:
+            version = self.watch.execute('PRAGMA data_version').fetchone()[0]
+            if version == self.data_version:
+                return
+            self.data_version = version
+            rows = self.watch.execute(
+                'SELECT id, at, balance FROM transactions WHERE phone = ? AND id > ? ORDER BY id',
+                (ADMIN_PHONE, self.series_row))
+            for row in rows:
+                self.admin_series.append(row['at'], row['balance'])
+                self.series_row = row['id']
+
+    @property
+    def db(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            # Autocommit mode, transactions are opened explicitly
+            conn = sqlite3.connect(self.path, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        db = self.db
+        started = time.perf_counter()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        TRANSACTION_SECONDS.observe(time.perf_counter() - started)
+
+    def load_account(self, row, transactions=True):
+        if row is None:
+            return None
+
+        return Account(
+            row['phone'], row['name'], row['balance'],
+            self.load_transactions(row['phone']) if transactions else None,
+            row['fingerprint_id'], row['password'],
+            row['archived'] or 0 if 'archived' in row.keys() else 0)
+
+    def load_transaction(self, row):
+        return Transaction(row['at'], row['amount'], row['type'], row['balance'], row['counterparty'])
+
+    def load_transaction_rows(self, rows):
+        # Settlements get their per-payer breakdown from settlement_payers
+        transactions = [self.load_transaction(row) for row in rows]
+        settlements = {row['id']: transaction for row, transaction in zip(rows, transactions)
+                       if row['type'] == 'settlement'}
+        if settlements:
+            payers = self.db.execute(
+                'SELECT transaction_id, phone, amount, payments FROM settlement_payers '
+                'WHERE transaction_id BETWEEN ? AND ?', (min(settlements), max(settlements)))
+            for payer in payers:
+                settlement = settlements.get(payer['transaction_id'])
+                if settlement is not None:
+                    if settlement.payers is None:
+                        settlement.payments = 0
+                        settlement.payers = {}
+                    settlement.payments += payer['payments']
+                    settlement.payers[payer['phone']] = [payer['amount'], payer['payments']]
+        return transactions
+
+    def load_transactions(self, phone):
+        rows = self.db.execute(
+            'SELECT id, at, amount, type, counterparty, balance FROM transactions '
+            'WHERE phone = ? ORDER BY id', (phone,)).fetchall()
+        return self.load_transaction_rows(rows)
+
+    def admin(self, transactions=True):
+        self.refresh()
+        row = self.db.execute('SELECT * FROM accounts WHERE phone = ?', (ADMIN_PHONE,)).fetchone()
+        return self.load_account(row, transactions)
+
+    def admin_transactions(self, start=None, end=None, cursor=None, limit=50):
+        # The cursor is the lowest row id already returned
+        query = 'SELECT id, at, amount, type, counterparty, balance FROM transactions WHERE phone = ?'
+        params = [ADMIN_PHONE]
+        if start is not None:
+            query += ' AND at >= ?'
+            params.append(start)
+        if end is not None:
+            query += ' AND at <= ?'
+            params.append(end)
+        if cursor is not None:
+            query += ' AND id < ?'
+            params.append(int(cursor))
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self.db.execute(query, params).fetchall()
+        page = rows[:limit]
+        next_cursor = str(page[-1]['id']) if len(rows) > limit else None
+        return self.load_transaction_rows(page), next_cursor
+
+    def find_user_by_phone(self, phone):
+        row = self.db.execute(
+            'SELECT accounts.*, archived_counts.count AS archived FROM accounts '
+            'LEFT JOIN archived_counts USING (phone) WHERE phone = ? AND is_admin = 0',
+            (phone,)).fetchone()
+        return self.load_account(row)
+
+    def find_user_by_fingerprint_id(self, fingerprint_id):
+        row = self.db.execute(
+            'SELECT accounts.*, archived_counts.count AS archived FROM accounts '
+            'LEFT JOIN archived_counts USING (phone) WHERE fingerprint_id = ?',
+            (fingerprint_id,)).fetchone()
+        return self.load_account(row)
+
+    def fingerprint_ids(self):
+        rows = self.db.execute('SELECT fingerprint_id FROM accounts WHERE fingerprint_id IS NOT NULL')
+        return [row['fingerprint_id'] for row in rows]
+
+    def insert_transaction(self, db, phone, transaction):
+        cursor = db.execute(
+            'INSERT INTO transactions (phone, at, amount, type, counterparty, balance) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (phone, transaction.at, transaction.amount, transaction.type,
+             transaction.counterparty, transaction.balance))
+        for payer_phone, (amount, payments) in (transaction.payers or {}).items():
+            db.execute(
+                'INSERT INTO settlement_payers (transaction_id, phone, amount, payments) '
+                'VALUES (?, ?, ?, ?)',
+                (cursor.lastrowid, payer_phone, amount, payments))
+
+    def insert_account(self, db, account, is_admin=False):
+        db.execute(
+            'INSERT INTO accounts (phone, name, fingerprint_id, password, is_admin, balance) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (account.phone, account.name, account.fingerprint_id,
+             account.password, int(is_admin), account.balance))
+        for transaction in account.transactions:
+            self.insert_transaction(db, account.phone, transaction)
+        if account.archived:
+            db.execute(
+                'INSERT INTO archived_counts (phone, count) VALUES (?, ?)',
+                (account.phone, account.archived))
+
+    def transfer(self, phone, amount):
+        if amount <= 0:
+            raise ValueError(f"Invalid amount: {amount}")
+
+        at = now()
+        # BEGIN IMMEDIATE takes the write lock up front, so the balance check
+        # and both updates see no interleaved writer
+        with self.transaction() as db:
+            user = db.execute(
+                'SELECT name, balance FROM accounts WHERE phone = ? AND is_admin = 0',
+                (phone,)).fetchone()
+            if user is None:
+                raise KeyError(phone)
+            if user['balance'] < amount:
+                raise InsufficientBalance(phone)
+
+            balance = user['balance'] - amount
+            db.execute('UPDATE accounts SET balance = ? WHERE phone = ?', (balance, phone))
+            self.insert_transaction(db, phone, Transaction(at, amount, "payment", balance))
+
+            if self.settle_every:
+                # The admin row is left alone until the next settlement
+                db.execute('INSERT INTO pending_credits (phone, amount) VALUES (?, ?)', (phone, amount))
+                pending_payments = db.execute('SELECT COUNT(*) FROM pending_credits').fetchone()[0]
+            else:
+                with tracing.span('admin_credit'):
+                    admin_balance = self.credit_admin(db, amount)
+                    self.insert_transaction(
+                        db, ADMIN_PHONE, Transaction(at, amount, "receive", admin_balance, user['name']))
+
+        if self.settle_every:
+            with tracing.span('admin_credit'):
+                self.schedule_settlement(pending_payments)
+        if self.hot_transactions:
+            count = self.db.execute(
+                'SELECT COUNT(*) FROM transactions WHERE phone = ?', (phone,)).fetchone()[0]
+            if count >= 2 * self.hot_transactions:
+                with tracing.span('archive'):
+                    self.archive_user(phone)
+        return self.find_user_by_phone(phone)
+
+    def archive_user(self, phone):
+        # Rows are written to the archive before the delete commits; a crash
+        # in between leaves them in both, and the archive reads them back once
+        with self.transaction() as db:
+            rows = db.execute(
+                'SELECT id, at, amount, type, counterparty, balance FROM transactions '
+                'WHERE phone = ? ORDER BY id', (phone,)).fetchall()
+            old = rows[:-self.hot_transactions]
+            if not old:
+                return
+            archived = db.execute(
+                'SELECT count FROM archived_counts WHERE phone = ?', (phone,)).fetchone()
+            archived = archived['count'] if archived is not None else 0
+
+            self.archive.append(phone, archived, self.load_transaction_rows(old))
+            db.execute('DELETE FROM transactions WHERE phone = ? AND id <= ?', (phone, old[-1]['id']))
+            db.execute(
+                'INSERT OR REPLACE INTO archived_counts (phone, count) VALUES (?, ?)',
+                (phone, archived + len(old)))
+
+    def credit_admin(self, db, amount):
+        admin = db.execute(
+            'SELECT balance FROM accounts WHERE phone = ?', (ADMIN_PHONE,)).fetchone()
+        admin_balance = admin['balance'] + amount
+        db.execute('UPDATE accounts SET balance = ? WHERE phone = ?', (admin_balance, ADMIN_PHONE))
+        return admin_balance
+
+    def load_pending(self, db):
+        rows = db.execute(
+            'SELECT phone, SUM(amount) AS amount, COUNT(*) AS payments FROM pending_credits '
+            'GROUP BY phone').fetchall()
+        if not rows:
+            return None
+
+        pending = new_settlement()
+        for row in rows:
+            pending['amount'] += row['amount']
+            pending['payments'] += row['payments']
+            pending['payers'][row['phone']] = [row['amount'], row['payments']]
+        return pending
+
+    def pending_settlement(self):
+        return self.load_pending(self.db)
+
+    def settle(self):
+        self.cancel_settlement_timer()
+        at = now()
+        with self.transaction() as db:
+            pending = self.load_pending(db)
+            if pending is None:
+                return None
+
+            admin_balance = self.credit_admin(db, pending['amount'])
+            settlement = Transaction(at, pending['amount'], "settlement", admin_balance,
+                                     None, pending['payments'], pending['payers'])
+            self.insert_transaction(db, ADMIN_PHONE, settlement)
+            db.execute('DELETE FROM pending_credits')
+            return settlement
+
+    def add_user(self, user):
+        with self.transaction() as db:
+            if db.execute('SELECT 1 FROM accounts WHERE phone = ?', (user.phone,)).fetchone():
+                raise PhoneTaken(user.phone)
+            self.insert_account(db, user)
+        return user
+
+    def import_data(self, accounts):
+        # Bulk load a ledger.AccountStore into an empty database
+        with self.transaction() as db:
+            if db.execute('SELECT COUNT(*) FROM accounts').fetchone()[0]:
+                raise ValueError(f"{self.path} already contains accounts")
+            self.insert_account(db, accounts.admin, is_admin=True)
+            for user in accounts.users:
+                self.insert_account(db, user)
+
+    def close(self):
+        self.settle()
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+        self.watch.close()
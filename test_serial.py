@@ -1,11 +1,12 @@
 import serial
 import time
+import protocol
 
 def test_serial():
     try:
         # Open port with basic settings
         ser = serial.Serial('COM7', 
-                          baudrate=9600,
+                          baudrate=protocol.DEFAULT_BAUDRATE,
                           bytesize=serial.EIGHTBITS,
                           parity=serial.PARITY_NONE,
                           stopbits=serial.STOPBITS_ONE,
@@ -20,13 +21,13 @@ def test_serial():
             
             # Send a test command
             print("Sending test command...")
-            ser.write(b'V\n')
+            ser.write(protocol.VERIFY_COMMAND)
             
             # Read response
             time.sleep(2)
             while ser.in_waiting:
                 response = ser.readline().decode('utf-8').strip()
-                print(f"Received: {response}")
+                print(f"Received: {response} -> {protocol.parse_line(response)}")
                 
         ser.close()
         print("Port closed successfully")
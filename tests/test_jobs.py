@@ -0,0 +1,22 @@
+from jobs import Job, Reservations
+
+
+def test_reservation_is_claimed_once_on_its_terms():
+    reservations = Reservations(ttl=30)
+    job = reservations.reserve("111", lambda: Job('capture'), 100)
+
+    assert reservations.reserve("111", lambda: Job('capture'), 100) is job
+    assert reservations.claim("111", "other", 100) is None
+    assert reservations.claim("111", job.id, 100000) is None
+    assert reservations.claim("111", job.id, 100) is job
+    assert reservations.claim("111", job.id, 100) is None
+
+
+def test_reservation_is_replaced_when_terms_change():
+    reservations = Reservations(ttl=30)
+    first = reservations.reserve("111", lambda: Job('capture'), 100)
+    second = reservations.reserve("111", lambda: Job('capture'), 100000)
+
+    assert second is not first
+    assert reservations.claim("111", first.id, 100) is None
+    assert reservations.claim("111", second.id, 100000) is second
@@ -0,0 +1,268 @@
+import json
+import os
+
+import pytest
+
+from ledger import InsufficientBalance, JournalLedger, PhoneTaken, read_journal
+from records import Account, Transaction, parse_date
+
+# JournalLedger recovery and replay: every test builds bank_data.json and the
+# journals by hand in a temporary directory, opens the ledger on them and
+# checks the state it rebuilt.
+
+DAY = 1700000000
+
+
+def user(phone, balance, fingerprint_id):
+    return Account(phone, f"User {phone}", balance, [Transaction(DAY, balance, "deposit", balance)],
+                   fingerprint_id=fingerprint_id)
+
+
+def write_json(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file)
+
+
+def write_lines(path, records, tail=b''):
+    with open(path, 'wb') as file:
+        for record in records:
+            file.write((json.dumps(record) + '\n').encode())
+        file.write(tail)
+
+
+def payment(seq, phone, amount, at=DAY, **extra):
+    return dict(seq=seq, op='payment', phone=phone, amount=amount, at=at, **extra)
+
+
+@pytest.fixture
+def files(tmp_path):
+    # bank_data.json with two users, 1000 and 500 paise
+    paths = {
+        'data': str(tmp_path / 'bank_data.json'),
+        'journal': str(tmp_path / 'bank_journal.jsonl'),
+        'archive': str(tmp_path / 'archive')
+    }
+    paths['old'] = paths['journal'] + '.old'
+    write_json(paths['data'], {
+        "format": 2,
+        "users": [user("111", 1000, 1).to_record(), user("222", 500, 2).to_record()],
+        "admin": Account("admin", "Admin", 0, password="secret").to_record()
+    })
+    return paths
+
+
+@pytest.fixture
+def open_ledger(files):
+    opened = []
+
+    def open_ledger(**options):
+        options.setdefault('snapshot_every', 1000)
+        options.setdefault('fsync', False)
+        options.setdefault('settle_every', 0)
+        options.setdefault('settle_seconds', 3600)
+        options.setdefault('hot_transactions', 0)
+        ledger = JournalLedger(files['data'], files['journal'], archive_dir=files['archive'], **options)
+        opened.append(ledger)
+        return ledger
+
+    yield open_ledger
+    for ledger in reversed(opened):
+        ledger.close()
+
+
+def balances(ledger):
+    return {phone: ledger.find_user_by_phone(phone).balance for phone in ("111", "222")}
+
+
+def test_read_journal_stops_at_torn_tail(files):
+    write_lines(files['journal'], [payment(1, "111", 100), payment(2, "111", 200)],
+                tail=b'{"seq":3,"op":"paym')
+
+    records, good_bytes = read_journal(files['journal'])
+
+    assert [record['seq'] for record in records] == [1, 2]
+    assert good_bytes < os.path.getsize(files['journal'])
+
+
+def test_recover_truncates_torn_tail(files, open_ledger):
+    write_lines(files['journal'], [payment(1, "111", 100), payment(2, "111", 200)],
+                tail=b'{"seq":3,"op":"payment","phone":"111","amou')
+    _, good_bytes = read_journal(files['journal'])
+
+    ledger = open_ledger()
+
+    assert balances(ledger) == {"111": 700, "222": 500}
+    assert ledger.admin().balance == 300
+    assert os.path.getsize(files['journal']) == good_bytes
+
+    # The next record follows the intact prefix
+    ledger.transfer("222", 50)
+    records, good_bytes = read_journal(files['journal'])
+    assert [record['seq'] for record in records] == [1, 2, 3]
+    assert good_bytes == os.path.getsize(files['journal'])
+
+
+def test_recover_replays_rotated_journal_once(files, open_ledger):
+    # A snapshot that already folded seq 1-2 was installed, but the process
+    # died before removing the rotated journal holding seq 1-4
+    snapshot = json.load(open(files['data']))
+    snapshot['journal_seq'] = 2
+    snapshot['users'][0]['balance'] = 700
+    snapshot['admin']['balance'] = 300
+    write_json(files['data'], snapshot)
+    write_lines(files['old'], [payment(1, "111", 100), payment(2, "111", 200),
+                               payment(3, "111", 50), payment(4, "222", 25)])
+    write_lines(files['journal'], [payment(5, "222", 75)])
+
+    ledger = open_ledger()
+
+    assert balances(ledger) == {"111": 650, "222": 400}
+    assert ledger.admin().balance == 450
+    assert ledger.seq == 5
+    # Folded into a new snapshot, both journals removed
+    assert not os.path.exists(files['old'])
+    assert json.load(open(files['data']))['journal_seq'] == 5
+
+    ledger.close()
+    assert balances(open_ledger()) == {"111": 650, "222": 400}
+
+
+def test_snapshot_and_journal_replay_match_live_state(files, open_ledger):
+    ledger = open_ledger(snapshot_every=3)
+    for amount in (10, 20, 30, 40, 50):
+        ledger.transfer("111", amount)
+    ledger.snapshot(wait=True)
+    ledger.transfer("222", 5)
+    # Let the background snapshot started by that transfer finish first
+    ledger.snapshot(wait=True)
+
+    replayed = open_ledger()
+
+    assert balances(replayed) == balances(ledger) == {"111": 850, "222": 495}
+    assert replayed.admin().balance == 155
+    assert [t.amount for t in replayed.find_user_by_phone("111").transactions] == [1000, 10, 20, 30, 40, 50]
+
+
+def test_transfer_rejects_overdraft(files, open_ledger):
+    ledger = open_ledger()
+
+    with pytest.raises(InsufficientBalance):
+        ledger.transfer("222", 501)
+    assert balances(ledger) == {"111": 1000, "222": 500}
+    assert read_journal(files['journal'])[0] == []
+
+    ledger.transfer("222", 500)
+    with pytest.raises(InsufficientBalance):
+        ledger.transfer("222", 1)
+    assert ledger.find_user_by_phone("222").balance == 0
+
+    with pytest.raises(KeyError):
+        ledger.transfer("999", 1)
+    with pytest.raises(ValueError):
+        ledger.transfer("111", 0)
+
+
+def test_settlement_replays(files, open_ledger):
+    ledger = open_ledger(settle_every=3)
+    ledger.transfer("111", 100)
+    ledger.transfer("222", 50)
+    assert ledger.admin().balance == 0
+    assert ledger.pending_settlement() == {"amount": 150, "payments": 2,
+                                           "payers": {"111": [100, 1], "222": [50, 1]}}
+
+    ledger.transfer("111", 25)
+
+    assert ledger.pending_settlement() is None
+    settlement = ledger.admin().transactions[-1]
+    assert settlement.type == "settlement"
+    assert (settlement.amount, settlement.payments) == (175, 3)
+    assert settlement.payers == {"111": [125, 2], "222": [50, 1]}
+
+    ledger.transfer("222", 10)
+    replayed = open_ledger(settle_every=3)
+    assert replayed.admin().balance == 175
+    assert replayed.admin().transactions[-1].payers == settlement.payers
+    assert replayed.pending_settlement() == {"amount": 10, "payments": 1, "payers": {"222": [10, 1]}}
+
+
+def test_archive_replays(files, open_ledger):
+    ledger = open_ledger(hot_transactions=2)
+    for amount in (10, 20, 30):
+        ledger.transfer("111", amount)
+
+    user = ledger.find_user_by_phone("111")
+    assert user.archived == 2
+    assert [t.amount for t in user.transactions] == [20, 30]
+
+    replayed = open_ledger(hot_transactions=2)
+    user = replayed.find_user_by_phone("111")
+    assert (user.archived, len(user.transactions)) == (2, 2)
+    assert [t.amount for t in replayed.statement("111")] == [1000, 10, 20, 30]
+    # The deposit is dated DAY, the payments now
+    assert [t.amount for t in replayed.statement("111", end=DAY)] == [1000]
+    assert [t.amount for t in replayed.statement("111", start=DAY + 1)] == [10, 20, 30]
+
+
+def test_converts_format_1_snapshot_and_journal(files, open_ledger):
+    # bank_data.json and journal records from before integer amounts
+    date = "2024-01-02 03:04:05"
+    write_json(files['data'], {
+        "users": [{"phone": "111", "name": "User 111", "balance": 10.5, "fingerprint_id": 1,
+                   "transactions": [{"date": date, "amount": 10.5, "type": "deposit", "balance": 10.5}]}],
+        "admin": {"phone": "admin", "name": "Admin", "balance": 0.0, "password": "secret",
+                  "transactions": []}
+    })
+    write_lines(files['journal'], [
+        {"seq": 1, "op": "payment", "phone": "111", "amount": 2.25, "date": date},
+        {"seq": 2, "op": "register", "user": {
+            "phone": "222", "name": "User 222", "balance": 5, "fingerprint_id": 2,
+            "transactions": [{"date": date, "amount": 5, "type": "deposit", "balance": 5}]}}
+    ])
+
+    ledger = open_ledger()
+
+    assert balances(ledger) == {"111": 825, "222": 500}
+    assert ledger.find_user_by_fingerprint_id(2).phone == "222"
+    payment = ledger.find_user_by_phone("111").transactions[-1]
+    assert (payment.at, payment.amount, payment.balance) == (parse_date(date), 225, 825)
+    assert ledger.admin().transactions[-1].counterparty == "User 111"
+
+    ledger.close()
+    assert json.load(open(files['data']))['format'] == 2
+    assert balances(open_ledger()) == {"111": 825, "222": 500}
+
+
+def test_snapshot_deferred_while_journal_is_in_use(files, open_ledger, monkeypatch):
+    # Windows refuses to rename a journal another process has open
+    replace = os.replace
+
+    def journal_in_use(src, dst):
+        if dst == files['old']:
+            raise PermissionError(13, "The process cannot access the file", src)
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', journal_in_use)
+    ledger = open_ledger(snapshot_every=2)
+    for amount in (10, 20, 30):
+        ledger.transfer("111", amount)
+
+    assert not os.path.exists(files['old'])
+    assert [record['seq'] for record in read_journal(files['journal'])[0]] == [1, 2, 3]
+    assert balances(open_ledger()) == {"111": 940, "222": 500}
+
+    monkeypatch.setattr(os, 'replace', replace)
+    ledger.transfer("111", 40)
+    ledger.snapshot(wait=True)
+    assert json.load(open(files['data']))['journal_seq'] == 4
+
+
+def test_add_user_rejects_phone_registered_by_another_process(files, open_ledger):
+    first, second = open_ledger(), open_ledger()
+    first.add_user(user("333", 100, 3))
+
+    with pytest.raises(PhoneTaken):
+        second.add_user(user("333", 200, 4))
+
+    assert second.find_user_by_phone("333").fingerprint_id == 3
+    assert second.find_user_by_fingerprint_id(4) is None
+    assert [record['op'] for record in read_journal(files['journal'])[0]] == ['register']
@@ -0,0 +1,73 @@
+import os
+import re
+
+import pytest
+
+pytest.importorskip('pty')  # the simulator needs a pseudo-terminal
+
+import sensor
+from sensor import SensorConnection
+from sensor_simulator import SimulatedSensor
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SensorConnection against the simulated bridge, with and without the 1:1
+# match command (M).
+
+
+@pytest.fixture
+def connect():
+    opened = []
+
+    def connect(**options):
+        simulator = SimulatedSensor(enrolled={5}, finger=5, match_latency=0.05, seed=1, **options)
+        connection = SensorConnection(simulator.start())
+        opened.append((simulator, connection))
+        return connection
+
+    yield connect
+    for simulator, connection in opened:
+        connection.close()
+        simulator.stop()
+
+
+def test_new_firmware_matches_by_id(connect):
+    connection = connect()
+
+    assert connection.verify(timeout=5, expected_id=5)[0] == 5
+    assert connection.matches_by_id is True
+    assert connection.verify(timeout=5, expected_id=5)[0] == 5
+
+
+def test_old_firmware_falls_back_to_search(connect):
+    connection = connect(firmware_match=False)
+
+    for probe in range(1, sensor.MATCH_PROBES):
+        assert connection.verify(timeout=5, expected_id=5)[0] == 5
+        assert connection.matches_by_id is None
+        assert connection.match_misses == probe
+
+    assert connection.verify(timeout=5, expected_id=5)[0] == 5
+    assert connection.matches_by_id is False
+    # No more probes, straight to the library search
+    assert connection.verify(timeout=5, expected_id=5)[0] == 5
+
+
+def test_late_match_ack_keeps_matching_by_id(connect):
+    connection = connect(match_ack_delay=1.5)
+
+    assert connection.verify(timeout=5, expected_id=5)[0] == 5
+    assert connection.matches_by_id is True
+    assert connection.match_misses == 0
+
+
+def test_simulator_banner_matches_firmware():
+    with open(os.path.join(REPO_DIR, 'fingerprint_arduino_bridge', 'fingerprint_arduino_bridge.ino')) as file:
+        firmware = re.findall(r'Serial\.println\("([A-Z] - [^"]*)"\)', file.read())
+    simulator = SimulatedSensor()
+    lines = []
+    simulator.println = lines.append
+
+    simulator.boot()
+
+    assert [line for line in lines if re.match(r'[A-Z] - ', line)] == firmware
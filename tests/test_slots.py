@@ -0,0 +1,34 @@
+import pytest
+
+from slots import LibraryFull, SlotAllocator
+
+
+def test_reserve_skips_used_slots():
+    slots = SlotAllocator(capacity=5, used=[0, 2])
+
+    assert slots.reserve() == 1
+    assert slots.reserve() == 3
+    assert slots.status() == {'capacity': 5, 'free': 1, 'reserved': 2}
+
+
+def test_release_frees_the_slot_and_commit_keeps_it():
+    slots = SlotAllocator(capacity=3)
+    first, second = slots.reserve(), slots.reserve()
+
+    slots.commit(second)
+    slots.release(first)
+    # Committed slots are no longer released
+    slots.release(second)
+
+    assert slots.status() == {'capacity': 3, 'free': 2, 'reserved': 0}
+    assert slots.reserve() == first
+    assert slots.reserve() == 2
+
+
+def test_full_library():
+    slots = SlotAllocator(capacity=2, used=[0, 1, 7])
+
+    with pytest.raises(LibraryFull):
+        slots.reserve()
+    slots.mark_used([1])
+    assert slots.status()['free'] == 0
@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+from ledger import InsufficientBalance, PhoneTaken
+from records import Account, parse_date
+from sqlite_ledger import SqliteLedger
+
+# The first SQLite layout: REAL rupees and TEXT dates, accounts and
+# transactions only
+SCHEMA_V1 = """
+CREATE TABLE accounts (
+    phone TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    fingerprint_id INTEGER UNIQUE,
+    password TEXT,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    balance REAL NOT NULL
+);
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    phone TEXT NOT NULL REFERENCES accounts(phone),
+    date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    type TEXT NOT NULL,
+    counterparty TEXT,
+    balance REAL NOT NULL
+);
+CREATE INDEX transactions_by_phone ON transactions(phone, id);
+"""
+
+DATE = "2024-01-02 03:04:05"
+
+
+@pytest.fixture
+def v1_database(tmp_path):
+    path = str(tmp_path / 'bank.db')
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA_V1)
+    conn.executemany('INSERT INTO accounts (phone, name, fingerprint_id, password, is_admin, balance) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', [
+                         ('admin', 'Admin', None, 'secret', 1, 2.25),
+                         ('111', 'User 111', 1, None, 0, 10.3)])
+    conn.executemany('INSERT INTO transactions (phone, date, amount, type, counterparty, balance) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', [
+                         ('111', DATE, 12.55, 'deposit', None, 12.55),
+                         ('111', DATE, 2.25, 'payment', None, 10.3),
+                         ('admin', DATE, 2.25, 'receive', 'User 111', 2.25)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def open_ledger(tmp_path):
+    opened = []
+
+    def open_ledger(path):
+        ledger = SqliteLedger(path, settle_every=0, settle_seconds=3600, hot_transactions=0,
+                              archive_dir=str(tmp_path / 'archive'))
+        opened.append(ledger)
+        return ledger
+
+    yield open_ledger
+    for ledger in opened:
+        ledger.close()
+
+
+def test_migrates_first_schema_to_paise(v1_database, open_ledger):
+    ledger = open_ledger(v1_database)
+
+    user = ledger.find_user_by_phone("111")
+    assert user.balance == 1030
+    assert [(t.at, t.amount, t.type, t.balance) for t in user.transactions] == [
+        (parse_date(DATE), 1255, 'deposit', 1255),
+        (parse_date(DATE), 225, 'payment', 1030)]
+    admin = ledger.admin()
+    assert admin.balance == 225
+    assert admin.transactions[-1].counterparty == 'User 111'
+    assert ledger.pending_settlement() is None
+
+    with sqlite3.connect(v1_database) as conn:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == 2
+
+    ledger.transfer("111", 30)
+    with pytest.raises(InsufficientBalance):
+        ledger.transfer("111", 1001)
+    assert ledger.find_user_by_phone("111").balance == 1000
+    assert ledger.admin().balance == 255
+
+
+def test_add_user_rejects_phone_registered_by_another_connection(v1_database, open_ledger):
+    first, second = open_ledger(v1_database), open_ledger(v1_database)
+    first.add_user(Account("333", "User 333", 100, fingerprint_id=3))
+
+    with pytest.raises(PhoneTaken):
+        second.add_user(Account("333", "Someone else", 200, fingerprint_id=4))
+
+    assert second.find_user_by_phone("333").name == "User 333"
+    assert second.find_user_by_fingerprint_id(4) is None
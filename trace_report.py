@@ -0,0 +1,67 @@
+import argparse
+import glob
+import json
+import math
+
+import config
+
+# Summarizes the trace log written by tracing.py: p50/p95/p99 per request type
+# and phase, to see whether time goes to the sensor, the Arduino reset or the
+# ledger. Usage: python trace_report.py [--name make_payment] [traces.jsonl]
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def read_traces(path):
+    # The live log plus its rotated backups (traces.jsonl.1, .2, ...)
+    for file_path in sorted(glob.glob(path + '.*'), reverse=True) + [path]:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            continue
+
+
+def summarize(traces, name=None, outcome=None):
+    # {(trace name, phase): [durations]}, the whole request as phase "total"
+    durations = {}
+    for trace in traces:
+        if name is not None and trace['name'] != name:
+            continue
+        if outcome is not None and trace['outcome'] != outcome:
+            continue
+        durations.setdefault((trace['name'], 'total'), []).append(trace['duration'])
+        for span in trace['spans']:
+            durations.setdefault((trace['name'], span['phase']), []).append(span['duration'])
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-phase latency percentiles from the trace log")
+    parser.add_argument('path', nargs='?', default=config.TRACE_FILE, help="trace log (default: %(default)s)")
+    parser.add_argument('--name', help="only this request type, e.g. make_payment or register")
+    parser.add_argument('--outcome', help="only traces with this outcome, e.g. success")
+    args = parser.parse_args()
+
+    durations = summarize(read_traces(args.path), args.name, args.outcome)
+    if not durations:
+        print(f"No traces found in {args.path}")
+        return
+
+    print(f"{'request':<14} {'phase':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for (trace_name, phase), values in sorted(durations.items()):
+        values.sort()
+        p50, p95, p99 = (percentile(values, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+        print(f"{trace_name:<14} {phase:<16} {len(values):>6} {p50:>9.1f} {p95:>9.1f} {p99:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+import config
+
+# Per-request phase timing. A Trace collects spans (phase, start offset,
+# duration) while it is active on a thread, and is written as one JSON line to
+# a rotating trace log when finished. Code deeper down (sensor, ledger) adds
+# spans with tracing.span(), which does nothing outside a trace.
+# Summarize the log with trace_report.py.
+
+local = threading.local()
+logger = None
+logger_lock = threading.Lock()
+
+
+def get_logger():
+    # The log file is only created once the first trace is written
+    global logger
+    with logger_lock:
+        if logger is None:
+            handler = RotatingFileHandler(config.TRACE_FILE, maxBytes=config.TRACE_MAX_BYTES,
+                                          backupCount=config.TRACE_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger = logging.getLogger('fingerpay.trace')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+        return logger
+
+
+class Trace:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.queued_at = None
+        self.spans = []
+
+    def add(self, phase, start, end):
+        self.spans.append({
+            "phase": phase,
+            "start": round(start - self.origin, 6),
+            "duration": round(end - start, 6)
+        })
+
+    @contextmanager
+    def span(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, start, time.perf_counter())
+
+    def queued(self):
+        self.queued_at = time.perf_counter()
+
+    def dequeued(self):
+        if self.queued_at is not None:
+            self.add('queue_wait', self.queued_at, time.perf_counter())
+
+    @contextmanager
+    def activate(self):
+        previous = getattr(local, 'trace', None)
+        local.trace = self
+        try:
+            yield self
+        finally:
+            local.trace = previous
+
+    def finish(self, outcome):
+        if not config.TRACE_FILE:
+            return
+        record = {
+            "trace": self.id,
+            "name": self.name,
+            "time": round(self.started, 3),
+            "duration": round(time.perf_counter() - self.origin, 6),
+            "outcome": outcome,
+            "spans": self.spans
+        }
+        try:
+            get_logger().info(json.dumps(record, separators=(',', ':')))
+        except Exception as e:
+            print(f"Error writing trace: {e}")
+
+
+def current():
+    return getattr(local, 'trace', None)
+
+
+@contextmanager
+def span(phase):
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.span(phase):
+        yield
+
+
+def add(phase, start, end):
+    # For spans timed with time.perf_counter() by the caller
+    trace = current()
+    if trace is not None:
+        trace.add(phase, start, end)